@@ -26,6 +26,12 @@ class PlentyDatabase:
             )
         )
 
+    def ensure_table(self, name, schema):
+        """ Create the table if it doesn't exist yet. """
+        if (name,) not in self.tables:
+            self.create_table(name, schema)
+            self.tables.append((name,))
+
     def insert(self, table: str, values: Tuple):
         self.cursor.execute(
             " ".join(
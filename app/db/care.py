@@ -1,15 +1,88 @@
 import json
 import datetime as dt
 import logging
-from typing import Union
+from typing import Union, Iterable
+import numpy as np
 
 from app.db.base import PlentyBaseAppModel
 from app.db import PlentyDatabase
 from app.db.utils import norm_species
+from app.db.plans import PlanCache
 
 logger = logging.getLogger('app.care.care')
 
 
+class HistoryIndex:
+    """
+    Sorted array of the day ordinals a plant was cared on
+    for a care type. The position of an ordinal in the array
+    is the prefix count of care days before it, so the care
+    count of any date window is two binary searches.
+    """
+
+    def __init__(self, dates: Iterable[dt.date] = ()):
+        self.ordinals = np.unique(
+            np.fromiter((d.toordinal() for d in dates), dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def __contains__(self, date: dt.date):
+        o = date.toordinal()
+        ix = np.searchsorted(self.ordinals, o)
+        return bool(ix < len(self.ordinals) and self.ordinals[ix] == o)
+
+    def count(self, from_date: dt.date, to_date: dt.date) -> int:
+        """ Number of care days from from_date up to, not including, to_date. """
+        lo, hi = np.searchsorted(
+            self.ordinals,
+            [from_date.toordinal(), to_date.toordinal()]
+        )
+        return int(max(hi - lo, 0))
+
+    def mean(self, from_date: dt.date, to_date: dt.date) -> float:
+        """ Share of the days in the window the plant was cared on. """
+        days = (to_date - from_date).days
+        if days <= 0:
+            return 0
+        return self.count(from_date, to_date) / days
+
+    def add(self, date: dt.date):
+        o = date.toordinal()
+        ix = np.searchsorted(self.ordinals, o)
+        if not (ix < len(self.ordinals) and self.ordinals[ix] == o):
+            self.ordinals = np.insert(self.ordinals, ix, o)
+
+
+class OverlayIndex(HistoryIndex):
+    """
+    Care day index of a history with simulated care days
+    kept on top of it. The base index is never modified.
+    """
+
+    def __init__(self, base: HistoryIndex):
+        self.base = base
+        self.delta = HistoryIndex()
+
+    @property
+    def ordinals(self):
+        return np.union1d(self.base.ordinals, self.delta.ordinals)
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def __contains__(self, date: dt.date):
+        return date in self.base or date in self.delta
+
+    def count(self, from_date: dt.date, to_date: dt.date) -> int:
+        return self.base.count(from_date, to_date) + self.delta.count(from_date, to_date)
+
+    def add(self, date: dt.date):
+        if date not in self.base:
+            self.delta.add(date)
+
+
 class CareHistory(PlentyBaseAppModel):
     _schema = [
         "id text, cond text, date text"
@@ -19,6 +92,7 @@ class CareHistory(PlentyBaseAppModel):
         self.plantae_id = plantae_id
         self.hist = self.get(self.plantae_id)
         self.today = dt.date.today()
+        self._index = dict()
 
     @staticmethod
     def query(plantae_id):
@@ -44,7 +118,23 @@ class CareHistory(PlentyBaseAppModel):
 
     def add(self, date: Union[str, dt.date], cond: str):
         with PlentyDatabase() as db:
-            db.insert(table='care_history', values=(self.plantae_id, cond, date))
+            db.insert(table='care_history', values=(self.plantae_id, cond, str(date)))
+        self.record(date, cond)
+        PlanCache.invalidate(self.plantae_id)
+
+    def record(self, date: Union[str, dt.date], cond: str):
+        """ Append a care event to the history in memory only. """
+        if isinstance(date, str):
+            date = dt.datetime.strptime(date, "%Y-%m-%d").date()
+        self.hist.append((self.plantae_id, cond, str(date)))
+        if cond in self._index:
+            self._index[cond].add(date)
+
+    def index(self, key) -> HistoryIndex:
+        """ Care day index of the care type, parsed once per history. """
+        if key not in self._index:
+            self._index[key] = HistoryIndex(self(key))
+        return self._index[key]
 
     def __call__(self, key):
         return [
@@ -54,6 +144,49 @@ class CareHistory(PlentyBaseAppModel):
         ]
 
 
+class SimulatedCareHistory:
+    """
+    Copy-on-write view over a care history. Simulated care
+    events are recorded apart from the real history rows,
+    which are shared with the underlying history.
+    """
+
+    def __init__(self, base: CareHistory):
+        self.base = base
+        self.plantae_id = base.plantae_id
+        self.today = base.today
+        self.events = []
+        self._index = dict()
+
+    @property
+    def hist(self):
+        return self.base.hist + self.events
+
+    def record(self, date: Union[str, dt.date], cond: str):
+        """ Record a simulated care event. """
+        if isinstance(date, str):
+            date = dt.datetime.strptime(date, "%Y-%m-%d").date()
+        self.events.append((self.plantae_id, cond, str(date)))
+        if cond in self._index:
+            self._index[cond].add(date)
+
+    def index(self, key) -> OverlayIndex:
+        if key not in self._index:
+            index = OverlayIndex(self.base.index(key))
+            for row in self.events:
+                if row[1] == key:
+                    index.add(dt.datetime.strptime(row[2], "%Y-%m-%d").date())
+            self._index[key] = index
+        return self._index[key]
+
+    def __call__(self, key):
+        return self.base(key) + [
+            dt.datetime.strptime(row[2], "%Y-%m-%d").date()
+            for row in self.events
+            if row[1] == key
+        ]
+
+
 class CareNeeds(PlentyBaseAppModel):
     _schema = [
         'species text, opt_cond_map text'
@@ -86,6 +219,7 @@ class CareNeeds(PlentyBaseAppModel):
     def add(species: str, needs: dict):
         with PlentyDatabase() as db:
             db.insert(table='care_needs', values=(norm_species(species), json.dumps(needs)))
+        PlanCache.invalidate_species(species)
 
     @staticmethod
     def update_needs(species: str, needs: dict):
@@ -94,3 +228,4 @@ class CareNeeds(PlentyBaseAppModel):
                 "UPDATE care_needs SET opt_cond_map = :needs WHERE species = :species",
                 {"species": norm_species(species), 'needs': json.dumps(needs)}
             )
+        PlanCache.invalidate_species(species)
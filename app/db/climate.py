@@ -0,0 +1,177 @@
+import json
+import datetime as dt
+import logging
+from typing import List, Tuple, Optional
+import pandas as pd
+
+from app.db.base import PlentyBaseAppModel
+from app.db import PlentyDatabase
+
+logger = logging.getLogger('app.climate')
+
+
+def location_key(location: Tuple) -> str:
+    return ','.join([str(i).lower() for i in location if i])
+
+
+class ClimateCache(PlentyBaseAppModel):
+    """
+    Climate conditions keyed by location and date range,
+    served while younger than the time-to-live. Entries
+    older than max_age are pruned when an entry is added.
+    """
+    table = 'climate_cache'
+    max_age = dt.timedelta(days=2)
+    _schema = [
+        "key text PRIMARY KEY, fetched_at text, cond text"
+    ]
+
+    @staticmethod
+    def key(location: Tuple, start: dt.datetime, end: dt.datetime, source: str = 'meteostat') -> str:
+        return '{loc}:{start}:{end}'.format(
+            loc=location_key(location) if source == 'meteostat' else F'{location_key(location)}@{source}',
+            start=start.strftime('%Y-%m-%d'),
+            end=end.strftime('%Y-%m-%d')
+        )
+
+    @classmethod
+    def query(cls, key: str):
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            q = db.cursor.execute(
+                F"SELECT * FROM {cls.table} WHERE key = :key",
+                {'key': key}
+            )
+            res = q.fetchone()
+        return res
+
+    @classmethod
+    def get(cls, key: str, ttl: dt.timedelta) -> Optional[dict]:
+        if q := cls.query(key):
+            age = dt.datetime.now() - dt.datetime.fromisoformat(q[1])
+            if age <= ttl:
+                logger.debug(F'climate cache hit for {key}.')
+                return json.loads(q[2])
+            logger.debug(F'climate cache expired for {key}.')
+        return None
+
+    @classmethod
+    def add(cls, key: str, cond: dict):
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            now = dt.datetime.now()
+            db.cursor.execute(
+                F"INSERT OR REPLACE INTO {cls.table} VALUES (?, ?, ?)",
+                (key, now.isoformat(), json.dumps(cond))
+            )
+            db.cursor.execute(
+                F"DELETE FROM {cls.table} WHERE fetched_at < :cutoff",
+                {'cutoff': (now - cls.max_age).isoformat()}
+            )
+
+
+class ClimateHistory(PlentyBaseAppModel):
+    """
+    Local store of the daily climate time series per location.
+    Only the days missing from the store need to be fetched.
+
+    Days a fetch returned no data for are stored empty. An empty
+    day is known once it was fetched settle_days after the date,
+    earlier it may not have been published yet and is fetched again.
+    """
+    table = 'climate_daily'
+    columns = ['tavg', 'tmin', 'tmax', 'tsun']
+    settle_days = 3
+    _schema = [
+        "location text, date text, tavg real, tmin real, tmax real, tsun real, fetched_at text, source text, "
+        "PRIMARY KEY (location, source, date)"
+    ]
+
+    @classmethod
+    def query(cls, location: str, start: dt.datetime, end: dt.datetime, source: str = 'meteostat'):
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            q = db.cursor.execute(
+                F"SELECT * FROM {cls.table} "
+                "WHERE location = :location AND source = :source AND date >= :start AND date <= :end "
+                "ORDER BY date",
+                {
+                    'location': location,
+                    'source': source,
+                    'start': start.strftime('%Y-%m-%d'),
+                    'end': end.strftime('%Y-%m-%d')
+                }
+            )
+            res = q.fetchall()
+        return res
+
+    @classmethod
+    def get(cls, location: str, start: dt.datetime, end: dt.datetime, source: str = 'meteostat') -> pd.DataFrame:
+        """ Daily climate of the location from the source between start and end, both included. """
+        rows = [row for row in cls.query(location, start, end, source) if row[2] is not None]
+        data = pd.DataFrame(
+            [row[2:6] for row in rows],
+            columns=cls.columns,
+            index=pd.to_datetime([row[1] for row in rows]),
+            dtype=float
+        )
+        data.index.name = 'time'
+        return data
+
+    @classmethod
+    def _known(cls, row) -> bool:
+        if row[2] is not None:
+            return True
+        settled = dt.date.fromisoformat(row[1]) + dt.timedelta(days=cls.settle_days)
+        return dt.datetime.fromisoformat(row[6]).date() >= settled
+
+    @classmethod
+    def missing(cls, location: str, start: dt.datetime, end: dt.datetime, source: str = 'meteostat') -> List[Tuple]:
+        """
+        Contiguous date ranges of the window, first and last day
+        included, that the store doesn't know the climate of
+        from the source.
+        """
+        known = {
+            row[1] for row in cls.query(location, start, end, source)
+            if cls._known(row)
+        }
+        gaps = []
+        for i in range((end - start).days + 1):
+            day = start + dt.timedelta(days=i)
+            if day.strftime('%Y-%m-%d') in known:
+                continue
+            if gaps and (day - gaps[-1][1]).days == 1:
+                gaps[-1] = (gaps[-1][0], day)
+            else:
+                gaps.append((day, day))
+        return gaps
+
+    @classmethod
+    def add(cls,
+            location: str,
+            data: pd.DataFrame,
+            start: dt.datetime = None,
+            end: dt.datetime = None,
+            source: str = 'meteostat'
+            ):
+        """
+        Store the daily climate of the source, replacing the days already stored.
+        The days between start and end without data are stored empty.
+        """
+        if start is not None and end is not None:
+            days = pd.date_range(start, end, freq='D')
+            data = data.reindex(days.union(data.index)) if not data.empty \
+                else pd.DataFrame(index=days, columns=cls.columns)
+        fetched_at = dt.datetime.now().isoformat()
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            db.cursor.executemany(
+                F"INSERT OR REPLACE INTO {cls.table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (location, time.strftime('%Y-%m-%d'))
+                    + tuple(None if pd.isna(v) else float(v) for v in row)
+                    + (fetched_at, source)
+                    for time, row in data.reindex(columns=cls.columns).iterrows()
+                ]
+            )
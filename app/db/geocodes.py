@@ -0,0 +1,84 @@
+import os
+import json
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.db.base import PlentyBaseAppModel
+from app.db import PlentyDatabase
+
+logger = logging.getLogger('app.geocodes')
+
+
+class Geocodes(PlentyBaseAppModel):
+    """
+    Coordinates of the locations, indexed by the
+    normalized location key.
+    """
+    table = 'geocodes'
+    _schema = [
+        "key text PRIMARY KEY, lat real, lon real"
+    ]
+
+    @staticmethod
+    def key(location: str) -> str:
+        """ Normalized key of a comma separated location. """
+        return ','.join([
+            part.strip().lower()
+            for part in location.split(',')
+            if part.strip()
+        ])
+
+    @classmethod
+    def query(cls, key: str):
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            q = db.cursor.execute(
+                F"SELECT lat, lon FROM {cls.table} WHERE key = :key",
+                {'key': cls.key(key)}
+            )
+            res = q.fetchone()
+        return res
+
+    @classmethod
+    def get(cls, location: str) -> Optional[Tuple[float, float]]:
+        """ Latitude and longitude of the location, None if unknown. """
+        if q := cls.query(location):
+            return q[0], q[1]
+        return None
+
+    @classmethod
+    def get_many(cls, locations: Iterable[str], chunk_size: int = 500) -> Dict[str, Tuple[float, float]]:
+        """ Coordinates of the known locations, keyed by the normalized location key. """
+        keys = list(dict.fromkeys(cls.key(loc) for loc in locations))
+        res = dict()
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                q = db.cursor.execute(
+                    F"SELECT key, lat, lon FROM {cls.table} WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                res.update({key: (lat, lon) for key, lat, lon in q.fetchall()})
+        return res
+
+    @classmethod
+    def add(cls, entries: Dict[str, Tuple[float, float]]):
+        """ Store the coordinates of the locations not stored yet, in one transaction. """
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            db.cursor.executemany(
+                F"INSERT OR IGNORE INTO {cls.table} VALUES (?, ?, ?)",
+                [(cls.key(loc), lat, lon) for loc, (lat, lon) in entries.items()]
+            )
+
+    @classmethod
+    def migrate(cls, path: str):
+        """ Import the geocodes of a legacy json file into an empty table. """
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            empty = db.cursor.execute(F"SELECT 1 FROM {cls.table} LIMIT 1").fetchone() is None
+        if empty and os.path.exists(path):
+            logger.info(F'importing geocodes from {path}.')
+            with open(path) as f:
+                cls.add({loc: tuple(coords) for loc, coords in json.load(f).items()})
@@ -0,0 +1,108 @@
+import json
+import hashlib
+import logging
+from typing import Dict, List, Tuple
+
+from app.db.base import PlentyBaseAppModel
+from app.db import PlentyDatabase
+from app.db.utils import norm_species
+
+logger = logging.getLogger('app.plans')
+
+
+def fingerprint(obj) -> str:
+    """ Stable SHA-256 hash of a json serialisable object or bytes. """
+    if isinstance(obj, bytes):
+        return hashlib.sha256(obj).hexdigest()
+    return hashlib.sha256(
+        json.dumps(obj, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class PlanCache(PlentyBaseAppModel):
+    """
+    Planned care schedules keyed by plant id, care type,
+    planner, start date, number of days and the hashes of
+    the history window, the climate, and the care needs
+    and plan options the schedule was planned with.
+    """
+    table = 'plan_cache'
+    key_columns = [
+        'id',
+        'care_type',
+        'planner',
+        'start_date',
+        'n_days',
+        'hist_hash',
+        'climate_hash',
+        'needs_hash'
+    ]
+    _schema = [
+        "id text, care_type text, planner text, start_date text, n_days integer, "
+        "hist_hash text, climate_hash text, needs_hash text, results text, "
+        "PRIMARY KEY (id, care_type, planner)"
+    ]
+
+    @classmethod
+    def _ensure_table(cls, db: PlentyDatabase):
+        db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+
+    @classmethod
+    def query(cls, keys: List[Tuple], chunk_size: int = 500):
+        """ Cached results row of each key, None for the keys not cached. """
+        ids = list(dict.fromkeys(str(key[0]) for key in keys))
+        rows = dict()
+        with PlentyDatabase() as db:
+            cls._ensure_table(db)
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                q = db.cursor.execute(
+                    F"SELECT {', '.join(cls.key_columns)}, results FROM {cls.table} "
+                    F"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                rows.update({tuple(map(str, row[:-1])): row[-1:] for row in q.fetchall()})
+        return [rows.get(tuple(map(str, key))) for key in keys]
+
+    @classmethod
+    def get(cls, keys: List[Tuple]) -> Dict[Tuple, List[int]]:
+        """ Cached care plan results of the keys found in the cache. """
+        return {
+            key: json.loads(row[0])
+            for key, row in zip(keys, cls.query(keys))
+            if row
+        }
+
+    @classmethod
+    def add(cls, entries: Dict[Tuple, List[int]]):
+        """ Cache care plan results, replacing older plans of the plant. """
+        with PlentyDatabase() as db:
+            cls._ensure_table(db)
+            db.cursor.executemany(
+                F"INSERT OR REPLACE INTO {cls.table} VALUES ({','.join('?' * (len(cls.key_columns) + 1))})",
+                [
+                    tuple(key) + (json.dumps([int(r) for r in results]),)
+                    for key, results in entries.items()
+                ]
+            )
+
+    @classmethod
+    def invalidate(cls, plantae_id: str):
+        logger.debug(F'invalidating cached plans of plant: {plantae_id}')
+        with PlentyDatabase() as db:
+            cls._ensure_table(db)
+            db.cursor.execute(
+                F"DELETE FROM {cls.table} WHERE id = :plant_id",
+                {'plant_id': plantae_id}
+            )
+
+    @classmethod
+    def invalidate_species(cls, species: str):
+        logger.debug(F'invalidating cached plans of species: {species}')
+        with PlentyDatabase() as db:
+            cls._ensure_table(db)
+            db.cursor.execute(
+                F"DELETE FROM {cls.table} WHERE id IN "
+                "(SELECT id FROM repertoire WHERE species = :species)",
+                {'species': norm_species(species)}
+            )
@@ -8,6 +8,7 @@ from app.db.base import PlentyBaseAppModel
 from app.db import PlentyDatabase
 from app.db.care import CareHistory
 from app.db.care import CareNeeds
+from app.db.care import SimulatedCareHistory
 from app.db.taxonomy import PlantTaxonomy
 from app.db.utils import norm_species
 
@@ -90,6 +91,21 @@ class PlantUnit(Plantae, PlentyBaseAppModel):
                       )
 
 
+class SimulatedPlant:
+    """
+    Lightweight view over a plant for planning simulations.
+    Attributes are read from the plant itself, while the
+    simulated care events go to a copy-on-write history.
+    """
+
+    def __init__(self, plant: PlantUnit):
+        self.plant = plant
+        self.hist = SimulatedCareHistory(plant.hist)
+
+    def __getattr__(self, name):
+        return getattr(self.plant, name)
+
+
 class Repertoire(PlentyBaseAppModel):
     _schema = [
         "id text, name text, cond text, species text"
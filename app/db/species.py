@@ -0,0 +1,87 @@
+import json
+import time
+import hashlib
+import logging
+from typing import List, Optional
+
+from app.db.base import PlentyBaseAppModel
+from app.db import PlentyDatabase
+
+logger = logging.getLogger('app.species')
+
+
+def _image_digest(image, chunk_size: int = 1 << 20) -> str:
+    """ SHA-256 of the image bytes, or of the file at the path read in chunks. """
+    digest = hashlib.sha256()
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        digest.update(image)
+    else:
+        with open(image, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache(PlentyBaseAppModel):
+    """
+    Parsed species prediction results keyed by the content
+    of the images and their organs, evicting the least
+    recently used predictions beyond max_entries.
+    """
+    table = 'species_prediction_cache'
+    max_entries = 1000
+    _schema = [
+        "key text PRIMARY KEY, results text, accessed_at real"
+    ]
+
+    @staticmethod
+    def key(images: List, organs: List[str], fusion: str = 'max') -> str:
+        """
+        SHA-256 of the image contents with their organs and
+        the rule fusing the results of the image groups,
+        independent of the order of the images. The images
+        are given as bytes or paths.
+        """
+        pairs = sorted(
+            _image_digest(image) + ':' + organ
+            for image, organ in zip(images, organs)
+        )
+        return hashlib.sha256('\n'.join(pairs + [fusion]).encode()).hexdigest()
+
+    @classmethod
+    def query(cls, key: str):
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            q = db.cursor.execute(
+                F"SELECT results FROM {cls.table} WHERE key = :key",
+                {'key': key}
+            )
+            res = q.fetchone()
+            if res:
+                db.cursor.execute(
+                    F"UPDATE {cls.table} SET accessed_at = :t WHERE key = :key",
+                    {'key': key, 't': time.time()}
+                )
+        return res
+
+    @classmethod
+    def get(cls, key: str) -> Optional[List[dict]]:
+        if q := cls.query(key):
+            logger.debug(F'species prediction cache hit for {key}.')
+            return json.loads(q[0])
+        return None
+
+    @classmethod
+    def add(cls, key: str, results: List[dict]):
+        """ Cache the results, evicting the least recently used beyond max_entries. """
+        with PlentyDatabase() as db:
+            db.ensure_table(cls.table, '(' + cls._schema[0] + ')')
+            db.cursor.execute(
+                F"INSERT OR REPLACE INTO {cls.table} VALUES (?, ?, ?)",
+                (key, json.dumps(results), time.time())
+            )
+            db.cursor.execute(
+                F"DELETE FROM {cls.table} WHERE key NOT IN "
+                F"(SELECT key FROM {cls.table} ORDER BY accessed_at DESC LIMIT :n)",
+                {'n': cls.max_entries}
+            )
@@ -89,20 +89,90 @@ def run_tests(ctx):
 @click.option("--planner_type", default='dynamic', type=click.Choice(['dynamic', 'naive', 'bayes']))
 @click.option("--impute", default=False)
 @click.option("--n_days", default=7)
+@click.option("--n_samples", default=0, help='ensemble size for the bayes planner.')
+@click.option("--cache/--no-cache", default=False, help='reuse plans of unchanged plants.')
+@click.option("--all_care_types", is_flag=True, default=False, help='plan every care type in the plant needs.')
+@click.option("--workers", default=1, help='number of planning processes, for a single care type plan.')
 @click.pass_context
-def plan(ctx, care_type, planner_type, impute, n_days):
+def plan(ctx, care_type, planner_type, impute, n_days, n_samples, cache, all_care_types, workers):
+    from types import SimpleNamespace
     from app.db.repertoire import Repertoire
     from plenty.care import planners
+    from plenty.climate import ClimateConditions
 
+    if workers > 1 and (all_care_types or n_samples):
+        raise click.UsageError('--workers can not be combined with --all_care_types or --n_samples.')
+    prefetch = ClimateConditions.prefetch()
     planner = planners.get_planner(planner_type)
-    rep = Repertoire()
-    for plant in rep.L:
+    if workers > 1:
+        rows = Repertoire.query()
+        prefetch.join()  # finish the load before the planning processes are forked.
         if ctx.obj['DEBUG']:
-            click.echo('optimizing for %s' % plant.name)
-        res = planner.plan(plant, care_type, optimise=True, impute=impute, n_days=n_days)
-        if res:
-            m = _plan_notification(plant, care_type, res)
+            click.echo('optimizing for %s plants on %s workers' % (len(rows), workers))
+        dates, results = planners.plan_parallel(
+            planner_type, rows, care_type, optimise=True, impute=impute, n_days=n_days, cache=cache, workers=workers
+        )
+        for row, plant_results in zip(rows, results):
+            plant = SimpleNamespace(id=row[0], name=row[1])
+            m = _plan_notification(plant, care_type, (dates, plant_results))
+            notify(f'Plenty Planner', m)
+        return
+    rep = Repertoire()
+    if all_care_types:
+        for plant in rep.L:
+            if ctx.obj['DEBUG']:
+                click.echo('optimizing for %s' % plant.name)
+            for plant_care_type, res in planner.plan_all(
+                    plant, optimise=True, impute=impute, n_days=n_days
+            ).items():
+                m = _plan_notification(plant, plant_care_type, res)
+                notify(f'Plenty Planner: {plant_care_type}', m)
+        return
+    if n_samples and planner_type == 'bayes':
+        for plant in rep.L:
+            if ctx.obj['DEBUG']:
+                click.echo('optimizing for %s' % plant.name)
+            dates, _, schedule = planner.plan_ensemble(
+                plant, care_type, optimise=True, impute=impute, n_days=n_days, n_samples=n_samples
+            )
+            m = _plan_notification(plant, care_type, (dates, schedule))
             notify(f'Plenty Planner', m)
+        return
+    if ctx.obj['DEBUG']:
+        click.echo('optimizing for %s plants' % len(rep.L))
+    dates, results = planner.plan_batch(
+        rep.L, care_type, optimise=True, impute=impute, n_days=n_days, cache=cache
+    )
+    for plant, plant_results in zip(rep.L, results):
+        m = _plan_notification(plant, care_type, (dates, plant_results))
+        notify(f'Plenty Planner', m)
+
+
+@cli.command()
+@click.option("--care_type", default='water')
+@click.option("--planner_type", multiple=True, default=['bayes', 'naive', 'dynamic'],
+              type=click.Choice(['dynamic', 'naive', 'bayes']))
+@click.option("--start_date", default=None, type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option("--end_date", default=None, type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option("--optimise", default=False)
+@click.pass_context
+def backtest(ctx, care_type, planner_type, start_date, end_date, optimise):
+    from app.db.repertoire import Repertoire
+    from plenty.care.backtest import backtest as run_backtest
+
+    rep = Repertoire()
+    report = run_backtest(
+        rep.L,
+        care_type,
+        planner_names=planner_type,
+        start_date=start_date.date() if start_date else None,
+        end_date=end_date.date() if end_date else None,
+        optimise=optimise
+    )
+    for name, metrics in report.items():
+        click.echo(name)
+        for metric, value in metrics.items():
+            click.echo('    %s: %s' % (metric, round(value, 3)))
 
 
 @cli.command()
@@ -305,12 +375,18 @@ def detect_disease(ctx, path, response_type, topn):
 @click.option("--path", default=None)
 @click.option("--response_type", default='best', type=click.Choice(['best']))
 @click.option("--topn", default=3)
+@click.option("--refresh", is_flag=True, default=False)
+@click.option("--downscale/--no-downscale", default=False, help='downscale the images before uploading them.')
+@click.option("--fusion", default='max', type=click.Choice(['max', 'mean']))
 @click.pass_context
-def detect_species(ctx, path, response_type, topn):
+def detect_species(ctx, path, response_type, topn, refresh, downscale, fusion):
     from plenty.models import species
     if ctx.obj['DEBUG'] and path is not None:
         click.echo('%s images found in %s' % (len(os.listdir(path)), path))
     res = species.predict(response_type,
+                          refresh=refresh,
+                          downscale=downscale,
+                          fusion=fusion,
                           topn=topn,
                           path=path
                           )
@@ -0,0 +1,387 @@
+import os
+import io
+import time
+import uuid
+import bisect
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+""" SHARED API CLIENT """
+
+logger = logging.getLogger('app.api.client')
+
+
+@dataclass
+class EndpointStats:
+    """ Latency counters of the requests sent to an endpoint. """
+    count: int = 0
+    errors: int = 0
+    retries: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_s / self.count * 1000 if self.count else 0.0
+
+    def observe(self, elapsed: float, error: bool = False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_s += elapsed
+        self.max_s = max(self.max_s, elapsed)
+
+
+class MultipartBody:
+    """
+    Streamed multipart/form-data request body.
+
+    The files are read when the body reaches them, so only
+    the chunk being sent is in memory. A file can be given
+    as bytes, as a path, opened when it is read and closed
+    after, as a binary file object read from its current
+    position, or as a callable producing the content (bytes
+    or a path) when its part is reached, kept only while the
+    part is sent.
+
+    The length of a body with callable parts is unknown and
+    reported as 0, requests then sends it chunked. The body
+    can be rewound to its start, so retries can resend it.
+
+    Parameters
+    ----------
+    fields: List[Tuple[str, str]]
+        names and values of the form fields
+    files: List[Tuple[str, str, Union[bytes, str, BinaryIO, Callable]]]
+        names, file names and contents of the form files
+    boundary: str
+        multipart boundary, random by default
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, fields: List[Tuple] = (), files: List[Tuple] = (), boundary: str = None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(
+                F'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                F'{value}\r\n'.encode()
+            )
+        for name, filename, source in files:
+            self._parts.append(
+                F'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                F'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+            )
+            self._parts.append(self._source(source))
+            self._parts.append(b'\r\n')
+        self._parts.append(F'--{self.boundary}--\r\n'.encode())
+        sizes = [self._size(part) for part in self._parts]
+        self.length = None if None in sizes else sum(sizes)
+        self._starts = None
+        if self.length is not None:
+            self._starts = [0]
+            for size in sizes:
+                self._starts.append(self._starts[-1] + size)
+        self._pos = 0
+        self._ix, self._offset = 0, 0
+        self._open = None
+
+    @staticmethod
+    def _source(source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return bytes(source)
+        if isinstance(source, (str, os.PathLike)):
+            return os.fspath(source)
+        if hasattr(source, 'read') and hasattr(source, 'seek'):
+            return source, source.tell()
+        if callable(source):
+            return source
+        raise TypeError(F'unsupported file content: {type(source).__name__}')
+
+    @staticmethod
+    def _size(part) -> Optional[int]:
+        if isinstance(part, bytes):
+            return len(part)
+        if isinstance(part, str):
+            return os.path.getsize(part)
+        if callable(part):
+            return None
+        handle, start = part
+        end = handle.seek(0, io.SEEK_END)
+        handle.seek(start)
+        return end - start
+
+    @property
+    def content_type(self) -> str:
+        return F'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length or 0
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        while chunk := self.read(self.chunk_size):
+            yield chunk
+
+    def _handle(self, ix: int):
+        """ File object of the part, opening its path or producing its content. """
+        if self._open is None or self._open[0] != ix:
+            self.close()
+            part = self._parts[ix]
+            if callable(part):
+                part = part()
+                part = os.fspath(part) if isinstance(part, os.PathLike) else part
+            if isinstance(part, str):
+                self._open = ix, open(part, 'rb'), 0, True
+            elif isinstance(part, (bytes, bytearray, memoryview)):
+                self._open = ix, io.BytesIO(part), 0, True
+            else:
+                self._open = ix, part[0], part[1], False
+        return self._open[1], self._open[2]
+
+    def _read_part(self, ix: int, offset: int, size: int) -> bytes:
+        part = self._parts[ix]
+        if isinstance(part, bytes):
+            return part[offset:offset + size]
+        handle, start = self._handle(ix)
+        handle.seek(start + offset)
+        return handle.read(size)
+
+    def _part_size(self, ix: int) -> Optional[int]:
+        return None if self._starts is None else self._starts[ix + 1] - self._starts[ix]
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = float('inf')
+        chunks = []
+        while size > 0 and self._ix < len(self._parts):
+            part_size = self._part_size(self._ix)
+            n = size if part_size is None else min(size, part_size - self._offset)
+            chunk = self._read_part(self._ix, self._offset, min(n, self.chunk_size)) if n > 0 else b''
+            if not chunk:
+                if part_size is not None and self._offset < part_size:
+                    raise IOError(F'multipart file part {self._ix} ended before its size.')
+                self.close()
+                self._ix, self._offset = self._ix + 1, 0
+                continue
+            chunks.append(chunk)
+            self._offset += len(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        if self._ix >= len(self._parts):
+            self.close()
+        return b''.join(chunks)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END and self.length is None:
+            raise io.UnsupportedOperation('the length of a body with callable parts is unknown.')
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.length}[whence]
+        pos = max(0, base + offset)
+        if pos == self._pos:
+            return pos
+        if pos == 0:
+            self.close()
+            self._ix, self._offset = 0, 0
+        elif self._starts is not None:
+            self._ix = min(bisect.bisect_right(self._starts, pos) - 1, len(self._parts))
+            self._offset = pos - self._starts[self._ix] if self._ix < len(self._parts) else 0
+        else:
+            raise io.UnsupportedOperation('a body with callable parts can only be rewound to its start.')
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        """ Release the file opened from its path or the produced content, if any. """
+        if self._open is not None:
+            _, handle, _, owned = self._open
+            if owned:
+                handle.close()
+            self._open = None
+
+
+class RateLimiter:
+    """
+    Spaces the calls of all threads evenly to
+    at most rate calls per second.
+    """
+
+    def __init__(self, rate: float = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ Block until the next call is allowed. """
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class ApiClient:
+    """
+    Http client shared by the requests to an api.
+
+    Keeps a pool of keep-alive connections, applies
+    connect and read timeouts, retries throttled (429)
+    and failed (5xx) responses and connection errors
+    with exponential backoff, and keeps latency counters
+    per endpoint. Other methods than the retry methods,
+    by default the idempotent ones, are only retried on
+    responses telling the request was not processed:
+    throttled (429) or unavailable (503) with Retry-After.
+
+    Parameters
+    ----------
+    name: str
+        name of the api
+    timeout: float, Tuple[float, float]
+        connect and read timeouts in seconds
+    retries: int
+        number of retries after the first attempt
+    backoff: float
+        seconds to wait before the first retry, doubled on every retry
+    max_backoff: float
+        maximum seconds to wait before a retry
+    pool_size: int
+        number of connections kept alive per host
+    retry_methods: Iterable[str]
+        http methods that are retried on any failure
+    """
+    retry_statuses = frozenset({429, 500, 502, 503, 504})
+    idempotent_methods = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+    def __init__(self,
+                 name: str,
+                 timeout: Union[float, Tuple[float, float]] = (3.05, 30),
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 pool_size: int = 10,
+                 retry_methods: Iterable[str] = None
+                 ):
+        self.name = name
+        self.retry_methods = frozenset(
+            m.upper() for m in (self.idempotent_methods if retry_methods is None else retry_methods)
+        )
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats: Dict[str, EndpointStats] = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        """ Endpoint of the url, without the query that may hold the api key. """
+        parts = urlsplit(url)
+        return F'{method.upper()} {parts.netloc}{parts.path}'
+
+    def _observe(self, endpoint: str, elapsed: float, error: bool = False, retry: bool = False):
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.observe(elapsed, error)
+            stats.retries += int(retry)
+
+    def _wait(self, attempt: int, res: requests.Response = None):
+        wait = min(self.max_backoff, self.backoff * 2 ** attempt)
+        retry_after = getattr(res, 'headers', {}).get('Retry-After')
+        if retry_after is not None and str(retry_after).isdigit():
+            wait = min(self.max_backoff, float(retry_after))
+        logger.debug(F'{self.name} request retrying in {wait:.2f} seconds.')
+        time.sleep(wait)
+
+    @staticmethod
+    def _seekables(kwargs: dict) -> list:
+        """ File objects of the request body and files, with their positions. """
+        files = kwargs.get('files') or []
+        files = files.values() if isinstance(files, dict) else [f[1] for f in files]
+        objs = [kwargs.get('data')] + [f[1] if isinstance(f, (tuple, list)) else f for f in files]
+        return [
+            (obj, obj.tell())
+            for obj in objs
+            if hasattr(obj, 'seek') and hasattr(obj, 'tell')
+        ]
+
+    def _retryable(self, res: requests.Response, idempotent: bool) -> bool:
+        """ Whether the response can be retried without the request being processed twice. """
+        if idempotent:
+            return res.status_code in self.retry_statuses
+        return res.status_code == 429 or (res.status_code == 503 and 'Retry-After' in res.headers)
+
+    @staticmethod
+    def _rewind(positions: list):
+        for obj, pos in positions:
+            obj.seek(pos)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send the request, retrying throttled and failed responses.
+
+        The response of the last attempt is returned, connection
+        errors and timeouts of the last attempt are raised.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self.endpoint(method, url)
+        positions = self._seekables(kwargs)
+        idempotent = method.upper() in self.retry_methods
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            if attempt:
+                self._rewind(positions)
+            t0 = time.perf_counter()
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._observe(endpoint, time.perf_counter() - t0, error=True, retry=idempotent and not last)
+                if last or not idempotent:
+                    raise
+                logger.warning(F'{self.name} request failed: {e}')
+                self._wait(attempt)
+                continue
+            retry = self._retryable(res, idempotent) and not last
+            self._observe(endpoint, time.perf_counter() - t0, error=res.status_code >= 400, retry=retry)
+            if not retry:
+                return res
+            logger.warning(F'{self.name} request returned status: {res.status_code}')
+            self._wait(attempt, res)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_clients: Dict[str, ApiClient] = dict()
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str, **options) -> ApiClient:
+    """
+    Shared client of the api, created with the
+    options on the first call for the name.
+    """
+    with _clients_lock:
+        if name not in _clients:
+            logger.debug(F'creating {name} api client.')
+            _clients[name] = ApiClient(name, **options)
+        return _clients[name]
@@ -1,10 +1,17 @@
+import os
 import logging
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Tuple
+import numpy as np
+import pandas as pd
 import requests
 import datetime as dt
 
 from plenty.api import util
+from plenty.api.client import get_client
+from plenty.api.client import RateLimiter
 from plenty.utils import write_json, read_json
+from app.db.geocodes import Geocodes
 
 """ OPENWEATHER API UTILS """
 
@@ -14,6 +21,12 @@ logger = logging.getLogger('app.api.openweathermap')
 
 # GET API ENDPOINTS
 GEOCODES_SAVE_PATH = './store/geocodes.json'
+HISTORY_CACHE_DIR = './store/history'
+HISTORY_WINDOW_DAYS = 7
+HISTORY_MAX_WORKERS = 4
+GEOCODE_MAX_WORKERS = 8
+GEOCODE_RATE_LIMIT = 10
+DAILY_COLUMNS = ['tavg', 'tmin', 'tmax', 'tsun']
 HISTORY_API_ENDPOINT_RAW = 'https://history.openweathermap.org/data/2.5/history/city?' \
                            'lat={lat}&lon={lon}&type=hour&start={start}&end={end}&units=metric&appid={api_key}'
 GEOCODE_API_ENDPOINT_RAW = 'http://api.openweathermap.org/geo/1.0/direct?q=' \
@@ -61,18 +74,26 @@ def process_history_req_input(lat: Union[int, float],
     )
 
 
+_geocodes_migrated = False
+
+
+def _migrate_geocodes():
+    global _geocodes_migrated
+    if not _geocodes_migrated:
+        Geocodes.migrate(GEOCODES_SAVE_PATH)
+        _geocodes_migrated = True
+
+
+def lookup_geocode(loc: str):
+    """ Saved coordinates of the location, None if unknown. """
+    _migrate_geocodes()
+    return Geocodes.get(loc)
+
+
 def save_geocode_response(res, loc):
-    logger.info('reading existing geocode data.')
-    d = read_json(GEOCODES_SAVE_PATH)
-    if loc not in d.keys():
-        d.update(
-            {loc: [res['lat'], res['lon']]}
-        )
     logger.info('saving geocode response.')
-    write_json(
-        GEOCODES_SAVE_PATH,
-        d
-    )
+    _migrate_geocodes()
+    Geocodes.add({loc: (res['lat'], res['lon'])})
 
 
 def geocoding_req(city: str,
@@ -83,10 +104,13 @@ def geocoding_req(city: str,
     LOC = _merge_loc_params(city, state_code, country_code)
     url = _get_geocode_endpoint(LOC, limit)
     try:
-        res = requests.get(url)
+        res = get_client('openweathermap').get(url)
         if res.status_code == 200:
+            if not (found := res.json()):
+                logger.warning(F'geocode api found no location for: {LOC}')
+                return {}, False
             logger.info('geocode api fetch so good!')
-            return res.json().pop(), True
+            return found.pop(), True
         else:
             logger.warning(
                 """
@@ -114,7 +138,7 @@ def history_req(lat: Union[int, float],
     )
     url = _get_history_endpoint(lat, lon, start, end)
     try:
-        res = requests.get(url)
+        res = get_client('openweathermap').get(url)
         if res.status_code == 200:
             logger.info('openweather api fetch so good!')
             return res.json().pop(), True
@@ -140,7 +164,7 @@ def get_point(city: str,
               country_code: str = None
               ):
     LOC = _merge_loc_params(city, state_code, country_code)
-    if saved_loc := read_json(GEOCODES_SAVE_PATH).get(LOC):
+    if saved_loc := lookup_geocode(LOC):
         logger.info(f'{LOC} is in existing geocode data.')
         lat, lon = saved_loc
     else:
@@ -152,18 +176,293 @@ def get_point(city: str,
     return lat, lon
 
 
+def history_windows(begin: int,
+                    end: int,
+                    window_days: int = HISTORY_WINDOW_DAYS
+                    ) -> List[Tuple[int, int]]:
+    """
+    Endpoint sized windows covering the time range.
+
+    The windows are aligned to multiples of the window
+    length since the epoch, so that a window fetched for
+    one range is the same window for every other range.
+
+    Parameters
+    ----------
+    begin: int
+        start of the range, unix timestamp in seconds
+    end: int
+        end of the range, unix timestamp in seconds
+    window_days: int
+        length of a window in days
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        start and end timestamps of the windows, the last
+        window is clipped to the end of the range.
+    """
+    if end <= begin:
+        return []
+    step = window_days * 24 * 3600
+    return [
+        (t, min(t + step, end))
+        for t in range(begin - begin % step, end, step)
+    ]
+
+
+class HistoryRequestError(Exception):
+    def __init__(self, message=None):
+        self.message = message or 'history request failed'
+        super().__init__(self.message)
+
+
+def _history_cache_path(lat, lon, start, end):
+    return os.path.join(HISTORY_CACHE_DIR, F'{lat}_{lon}_{start}_{end}.json')
+
+
+def history_window_req(lat: float,
+                       lon: float,
+                       start: int,
+                       end: int,
+                       cache: bool = True
+                       ) -> List[dict]:
+    """
+    Hourly history records of a window, read from the
+    window cache if fetched before. A window is cached
+    only when its records reach the end of the window.
+
+    Raises
+    ------
+    HistoryRequestError
+        if the window couldn't be fetched.
+    """
+    path = _history_cache_path(lat, lon, start, end)
+    if cache and os.path.exists(path):
+        logger.debug(F'history window {start}-{end} is cached.')
+        return read_json(path)
+    url = _get_history_endpoint(lat, lon, start, end)
+    try:
+        res = get_client('openweathermap').get(url)
+    except requests.exceptions.RequestException as e:
+        logger.exception(e)
+        raise HistoryRequestError(F'history window {start}-{end} request failed: {e}') from e
+    if res.status_code != 200:
+        logger.warning(F'history window {start}-{end} request failed with status: {res.status_code}')
+        raise HistoryRequestError(F'history window {start}-{end} request failed with status: {res.status_code}')
+    records = res.json().get('list', [])
+    if cache and records and max(r['dt'] for r in records) >= end - 3600:
+        os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+        write_json(path, records)
+    return records
+
+
+def get_points(locations: List[Tuple],
+               workers: int = GEOCODE_MAX_WORKERS,
+               rate: float = GEOCODE_RATE_LIMIT
+               ) -> List[Tuple]:
+    """
+    Coordinates of many locations.
+
+    The locations are deduplicated by their normalized key,
+    the saved coordinates are answered from the geocode store,
+    and the missing locations are requested concurrently at no
+    more than rate requests per second. The new coordinates are
+    saved in one transaction.
+
+    Parameters
+    ----------
+    locations: List[Tuple]
+        (city, state_code, country_code) of the locations
+    workers: int
+        maximum number of concurrent requests
+    rate: float
+        maximum number of requests per second
+
+    Returns
+    -------
+    List[Tuple]
+        latitude and longitude of each location, None
+        for the locations that couldn't be geocoded.
+    """
+    _migrate_geocodes()
+    keys = [Geocodes.key(_merge_loc_params(*loc)) for loc in locations]
+    points = Geocodes.get_many(keys)
+    missing = dict()
+    for key, loc in zip(keys, locations):
+        if key not in points:
+            missing.setdefault(key, loc)
+    logger.info(F'{len(points)} locations are in existing geocode data, {len(missing)} are not.')
+    if missing:
+        limiter = RateLimiter(rate)
+
+        def _request(loc):
+            limiter.wait()
+            return geocoding_req(*loc)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as executor:
+            responses = executor.map(_request, missing.values())
+            found = {
+                key: (gr['lat'], gr['lon'])
+                for key, (gr, success) in zip(missing, responses)
+                if success
+            }
+        if found:
+            Geocodes.add(found)
+        points.update(found)
+    return [points.get(key, (None, None)) for key in keys]
+
+
 def get_history(city: str,
                 state_code: str = None,
                 country_code: str = None,
                 start: dt.time = None,
-                days_back: int = 7
-                ):
-    logging.info('getting weather history.')
+                days_back: int = 7,
+                window_days: int = HISTORY_WINDOW_DAYS,
+                workers: int = HISTORY_MAX_WORKERS
+                ) -> List[dict]:
+    """
+    Hourly weather history of the location.
+
+    The range is split into endpoint sized windows that
+    are fetched concurrently, complete windows are cached
+    and not fetched again.
+
+    Parameters
+    ----------
+    city: str
+    state_code: str
+    country_code: str
+    start: datetime
+        end of the history range, defaults to now.
+    days_back: int
+        number of days of history before the start.
+    window_days: int
+        length of a requested window in days
+    workers: int
+        maximum number of concurrent requests
+
+    Returns
+    -------
+    List[dict]
+        hourly history records in time order
+
+    Raises
+    ------
+    HistoryRequestError
+        if any window couldn't be fetched, the history
+        is never returned with windows missing.
+    """
+    logger.info('getting weather history.')
     lat, lon = get_point(city, state_code, country_code)
-    hr, _ = history_req(
-        lat,
-        lon,
-        start,
-        days_back
+    lat, lon, end, begin = process_history_req_input(lat, lon, start, days_back)
+    begin, end = int(begin), int(end)
+    windows = history_windows(begin, end, window_days)
+    step = window_days * 24 * 3600
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as executor:
+        chunks = executor.map(
+            lambda w: history_window_req(lat, lon, w[0], w[1], cache=w[1] - w[0] == step),
+            windows
+        )
+        records = {
+            r['dt']: r
+            for chunk in chunks
+            for r in chunk
+            if begin <= r['dt'] <= end
+        }
+    logger.debug(F'merged {len(records)} history records from {len(windows)} windows.')
+    return [records[t] for t in sorted(records)]
+
+
+def _hourly_sunshine(record: dict) -> float:
+    """
+    Estimated minutes of sunshine in the hour, the clear
+    share of the sky during daytime hours.
+    """
+    weather = record.get('weather') or [{}]
+    icon = weather[0].get('icon') or ''
+    if not icon:
+        return np.nan
+    if not icon.endswith('d'):
+        return 0.0
+    return 60.0 * (1.0 - record.get('clouds', {}).get('all', 0.0) / 100.0)
+
+
+def history_to_daily(records: List[dict]) -> pd.DataFrame:
+    """
+    Daily aggregates of hourly history records.
+
+    Every field is streamed once into a numpy column, and
+    the days are aggregated with bincount and reduceat over
+    the records sorted by day (UTC).
+
+    Parameters
+    ----------
+    records: List[dict]
+        hourly history records of the openweathermap history api
+
+    Returns
+    -------
+    pd.DataFrame
+        daily tavg, tmin, tmax (celsius) and tsun (minutes),
+        indexed by the date as 'time'.
+    """
+    n = len(records)
+    if not n:
+        return pd.DataFrame(columns=DAILY_COLUMNS, index=pd.DatetimeIndex([], name='time'), dtype=float)
+    t = np.fromiter((r['dt'] for r in records), dtype=np.int64, count=n)
+    temp = np.fromiter((r['main'].get('temp', np.nan) for r in records), dtype=float, count=n)
+    temp_min = np.fromiter((r['main'].get('temp_min', np.nan) for r in records), dtype=float, count=n)
+    temp_max = np.fromiter((r['main'].get('temp_max', np.nan) for r in records), dtype=float, count=n)
+    sun = np.fromiter((_hourly_sunshine(r) for r in records), dtype=float, count=n)
+    temp_min = np.where(np.isnan(temp_min), temp, temp_min)
+    temp_max = np.where(np.isnan(temp_max), temp, temp_max)
+
+    days = t // (24 * 3600)
+    order = np.argsort(days, kind='stable')
+    days, temp, temp_min, temp_max, sun = days[order], temp[order], temp_min[order], temp_max[order], sun[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(days) != 0])
+    inverse = np.cumsum(np.r_[False, np.diff(days) != 0])
+
+    def _mean(x):
+        valid = ~np.isnan(x)
+        counts = np.bincount(inverse, weights=valid)
+        sums = np.bincount(inverse, weights=np.where(valid, x, 0.0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def _sum(x):
+        valid = ~np.isnan(x)
+        counts = np.bincount(inverse, weights=valid)
+        return np.where(counts > 0, np.bincount(inverse, weights=np.where(valid, x, 0.0)), np.nan)
+
+    return pd.DataFrame(
+        {
+            'tavg': _mean(temp),
+            'tmin': np.fmin.reduceat(temp_min, starts),
+            'tmax': np.fmax.reduceat(temp_max, starts),
+            'tsun': _sum(sun),
+        },
+        index=pd.DatetimeIndex(pd.to_datetime(days[starts], unit='D'), name='time')
+    )
+
+
+def get_daily_history(city: str,
+                      state_code: str = None,
+                      country_code: str = None,
+                      start: dt.datetime = None,
+                      end: dt.datetime = None
+                      ) -> pd.DataFrame:
+    """
+    Daily weather history of the location from the first
+    to the last date, in the shape of the meteostat daily data.
+    """
+    end = end or dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = start or end - dt.timedelta(days=7)
+    range_end = dt.datetime.combine(end.date() + dt.timedelta(days=1), dt.time())
+    records = get_history(
+        city, state_code, country_code,
+        start=range_end,
+        days_back=(range_end.date() - start.date()).days
     )
-    return hr
+    daily = history_to_daily(records)
+    return daily[(daily.index >= pd.Timestamp(start.date())) & (daily.index <= pd.Timestamp(end.date()))]
@@ -4,6 +4,8 @@ from typing import List
 import random
 
 from plenty.api import util
+from plenty.api.client import get_client
+from plenty.api.client import MultipartBody
 
 logger = logging.getLogger('app.api.plantnet')
 
@@ -28,22 +30,33 @@ def get_prediction(images: List,
                    organs: List[str],
                    image_paths=None
                    ):
-    data = {'organs': organs}
+    """
+    Species prediction of the images from plantnet.
+
+    The images can be given as bytes, paths, binary file
+    objects or callables producing the image when it is sent,
+    they are streamed into the request body so that they are
+    never all in memory at once.
+    """
     path_given = True
     if image_paths is None:
         path_given = False
         image_paths = [None] * len(images)
-    image_files = [
-        (
-            'images',
-            (_gen_rand_image_path(path) if not path_given else image_paths[ix], img)
-        )
-        for ix, (img, path) in enumerate(zip(images, image_paths))
-    ]
+    body = MultipartBody(
+        fields=[('organs', organ) for organ in organs],
+        files=[
+            ('images', _gen_rand_image_path(path) if not path_given else image_paths[ix], img)
+            for ix, (img, path) in enumerate(zip(images, image_paths))
+        ]
+    )
     try:
         logger.info('requesting image prediction from plantnet.')
         api_url = get_endpoint()
-        res = requests.post(api_url, files=image_files, data=data)
+        res = get_client('plantnet').post(
+            api_url,
+            data=body,
+            headers={'Content-Type': body.content_type}
+        )
         logger.debug(F'request status code: {res.status_code}')
         if res.status_code == 200:
             return res.json(), True
@@ -52,3 +65,5 @@ def get_prediction(images: List,
     except requests.exceptions.RequestException as e:
         logger.exception(F'request exception: {str(e)}')
         return str(e), False
+    finally:
+        body.close()
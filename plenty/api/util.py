@@ -1,6 +1,8 @@
 import os
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def get_api_key(name: str = 'plantnet'):
     api_path = F'./{name}_apikey.txt'
     if os.path.exists(api_path):
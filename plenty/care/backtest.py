@@ -0,0 +1,123 @@
+import time
+import datetime as dt
+import logging
+from typing import List, Dict, Iterable
+import numpy as np
+
+from app.db.repertoire import PlantUnit
+from plenty.care import planners
+
+"""
+Planner backtesting and throughput benchmarking.
+
+The care history is replayed day by day. Every planner
+plans each past date only from the care logged before
+that date, and the planned care is compared with the
+care actually logged on the date.
+"""
+
+logger = logging.getLogger('app.care.backtest')
+
+
+def _date_range(plants: List[PlantUnit], care_type: str):
+    ordinals = np.concatenate(
+        [plant.hist.index(care_type).ordinals for plant in plants]
+    ) if plants else np.array([], dtype=np.int64)
+    if not len(ordinals):
+        return None, None
+    return dt.date.fromordinal(int(ordinals.min())), dt.date.fromordinal(int(ordinals.max()))
+
+
+def agreement_metrics(planned: np.ndarray, actual: np.ndarray) -> Dict[str, float]:
+    """
+    Agreement of the planned care with the logged care.
+
+    Parameters
+    ----------
+    planned: np.ndarray
+        1 if care was planned on the day, 0 if not.
+    actual: np.ndarray
+        1 if care was logged on the day, 0 if not.
+
+    Returns
+    -------
+    Dict[str, float]
+        agreement, precision, recall, planned and logged care rates
+    """
+    tp = int(np.sum((planned == 1) & (actual == 1)))
+    return {
+        'agreement': float(np.mean(planned == actual)) if len(planned) else 0.0,
+        'precision': tp / int(np.sum(planned)) if np.sum(planned) else 0.0,
+        'recall': tp / int(np.sum(actual)) if np.sum(actual) else 0.0,
+        'planned_rate': float(np.mean(planned)) if len(planned) else 0.0,
+        'logged_rate': float(np.mean(actual)) if len(actual) else 0.0,
+    }
+
+
+def backtest(plants: List[PlantUnit],
+             care_type: str,
+             planner_names: Iterable[str] = ('bayes', 'naive', 'dynamic'),
+             start_date: dt.date = None,
+             end_date: dt.date = None,
+             optimise: bool = False
+             ) -> Dict[str, Dict[str, float]]:
+    """
+    Backtest the planners on the logged care history.
+
+    Parameters
+    ----------
+    plants: List[PlantUnit]
+        plants with care history
+    care_type: str
+        care type name
+    planner_names: Iterable[str]
+        names of the planners to backtest
+    start_date: date
+        first replayed date, defaults to the first logged care date.
+    end_date: date
+        last replayed date, defaults to the last logged care date.
+    optimise: bool
+        optimise the needs with the climate conditions
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        agreement metrics, plans per second and
+        p50/p99 step latency in ms per planner
+    """
+    first, last = _date_range(plants, care_type)
+    start_date = first if start_date is None else start_date
+    end_date = last if end_date is None else end_date
+    if start_date is None or end_date is None:
+        logger.warning(F'no {care_type} care history to backtest.')
+        return {}
+    n_days = (end_date - start_date).days + 1
+    logger.info(F'backtesting {len(plants)} plants over {n_days} days.')
+    dates = [start_date + dt.timedelta(days=i) for i in range(n_days)]
+    actual = np.array([
+        int(date in plant.hist.index(care_type))
+        for plant in plants
+        for date in dates
+    ])
+    report = dict()
+    for name in planner_names:
+        planner = planners.get_planner(name)
+        planned = np.zeros(len(actual), dtype=int)
+        latencies = np.zeros(len(actual))
+        ix = 0
+        for plant in plants:
+            for date in dates:
+                t0 = time.perf_counter()
+                planned[ix] = planner.step(plant, care_type, date, optimise=optimise)
+                latencies[ix] = time.perf_counter() - t0
+                ix += 1
+        total = float(np.sum(latencies))
+        report[name] = {
+            **agreement_metrics(planned, actual),
+            'n_plans': len(planned),
+            'plans_per_second': len(planned) / total if total else 0.0,
+            'p50_latency_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0,
+            'p99_latency_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else 0.0,
+        }
+        logger.debug(F'{name} backtest: {report[name]}')
+    return report
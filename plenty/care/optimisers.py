@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 import logging
+from typing import Dict, List
 import numpy as np
-import math
 
 """ 
 Care optimisations based on factors like weather, light etc. 
@@ -47,7 +47,7 @@ def mean_weighted_temperature(external_cond, indoor=True):
 
     Parameters
     ----------
-    external_cond: dict
+    external_cond: Union[dict, plenty.climate.ClimateFeatures]
         external conditions
     indoor: bool
         True if indoor plant, otherwise False
@@ -56,11 +56,14 @@ def mean_weighted_temperature(external_cond, indoor=True):
     -------
     Union[float, None]
     """
+    if not isinstance(external_cond, dict):
+        # precomputed climate feature snapshot
+        return external_cond.weighted_temperature(indoor)
     if not indoor:
         t_arr = external_cond.get('tavg')
     else:
         t_arr = external_cond.get('t_avg_ind')
-    if t_arr:
+    if t_arr is not None and len(t_arr):
         wgt = mk_recency_weights(len(t_arr))
         t_mu = float(
             np.sum(np.array(t_arr) * wgt) / np.sum(wgt)
@@ -70,6 +73,43 @@ def mean_weighted_temperature(external_cond, indoor=True):
     return t_mu
 
 
+def temperature_weights(needs: List[dict], plant_conds: List[dict], external_cond) -> np.ndarray:
+    """
+    Vectorized temperature weight factors of many plants.
+    Plants within a degree of their optimal temperature get a weight of 1.
+
+    Parameters
+    ----------
+    needs: List[dict]
+        plenty.repertoire.PlantUnit.needs per plant
+    plant_conds: List[dict]
+        plenty.repertoire.PlantUnit.conditions per plant
+    external_cond: dict
+        plenty.climate.ClimateConditions
+
+    Returns
+    -------
+    np.ndarray
+        temperature weight factor per plant
+    """
+    t_o = np.array([optimal_temperature_center(n) for n in needs], dtype=float)
+    indoor = np.array([c.get('indoor', True) for c in plant_conds], dtype=bool)
+    t_ind, t_out = (
+        mean_weighted_temperature(external_cond, indoor=True),
+        mean_weighted_temperature(external_cond, indoor=False)
+    )
+    t_m = np.where(
+        indoor,
+        np.nan if t_ind is None else t_ind,
+        np.nan if t_out is None else t_out
+    )
+    t_m = np.where(np.isnan(t_m), t_o, t_m)
+    d = t_o - t_m
+    # differences within a degree weigh 1, so the log never drops below 0.
+    w = 1 + np.log10(np.maximum(np.abs(d), 1.0))
+    return np.where(d > 0, w, 1 / w)
+
+
 class CareOpt(ABC):
     """
     Care type optimizer. This module is the main
@@ -103,6 +143,12 @@ class CareOpt(ABC):
 
     """
 
+    registry: Dict[str, type] = dict()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        CareOpt.registry[cls.care_type] = cls
+
     def __init__(self,
                  base_tmw=None,
                  base_dhw=None,
@@ -123,6 +169,39 @@ class CareOpt(ABC):
     def opt(self, *args, **kwargs):
         pass
 
+    @classmethod
+    def batch_weights(cls, needs: List[dict], plant_conds: List[dict], external_cond) -> np.ndarray:
+        """ Combined weight factor per plant, 1 if not optimised. """
+        return np.ones(len(needs))
+
+    @classmethod
+    def opt_batch(cls,
+                  freq: np.ndarray,
+                  needs: List[dict],
+                  plant_conds: List[dict],
+                  external_cond
+                  ) -> np.ndarray:
+        """
+        Stateless, vectorized version of opt for many plants.
+
+        Parameters
+        ----------
+        freq: np.ndarray
+            care frequency per plant
+        needs: List[dict]
+            plenty.repertoire.PlantUnit.needs per plant
+        plant_conds: List[dict]
+            plenty.repertoire.PlantUnit.conditions per plant
+        external_cond: dict
+            plenty.climate.ClimateConditions
+
+        Returns
+        -------
+        np.ndarray
+            optimised care need per plant
+        """
+        return np.asarray(freq, dtype=float) * cls.batch_weights(needs, plant_conds, external_cond)
+
 
 class NoOpt(CareOpt):
     care_type = None
@@ -159,16 +238,7 @@ class WaterOpt(CareOpt):
         float
             temperature weight factor
         """
-        t_o = optimal_temperature_center(needs)
-        t_m = mean_weighted_temperature(external_cond, plant_cond.get('indoor', True))
-        if t_m is None:
-            t_m = t_o
-        d = t_o - t_m
-        w = 1 + math.log(abs(d), 10)
-        if d > 0:
-            self.base_tmw = w
-        else:
-            self.base_tmw = 1/w
+        self.base_tmw = float(temperature_weights([needs], [plant_cond], external_cond)[0])
 
     def set_drainage_weight(self, needs, plant_cond):
         """
@@ -220,6 +290,11 @@ class WaterOpt(CareOpt):
             self.base_lgw *\
             self.base_dhw
 
+    @classmethod
+    def batch_weights(cls, needs, plant_conds, external_cond):
+        # drainage, light and daylight hours weights are all 1 for watering.
+        return temperature_weights(needs, plant_conds, external_cond)
+
 
 class MistOpt(CareOpt):
     care_type = 'mist'
@@ -245,16 +320,7 @@ class MistOpt(CareOpt):
         float
             temperature weight factor
         """
-        t_o = optimal_temperature_center(needs)
-        t_m = mean_weighted_temperature(external_cond, plant_cond.get('indoor', True))
-        if t_m is None:
-            t_m = t_o
-        d = t_o - t_m
-        w = 1 + math.log(abs(d), 10)
-        if d > 0:
-            self.base_tmw = w
-        else:
-            self.base_tmw = 1 / w
+        self.base_tmw = float(temperature_weights([needs], [plant_cond], external_cond)[0])
 
     def set_light_weight(self, needs, plant_cond):
         """
@@ -302,16 +368,26 @@ class MistOpt(CareOpt):
             self.base_lgw *\
             self.base_dhw
 
+    @classmethod
+    def batch_weights(cls, needs, plant_conds, external_cond):
+        need = np.array([n.get('light', {}).get('score', 0.5) for n in needs], dtype=float)
+        has = np.array([c.get('light', {}).get('score', 0.5) for c in plant_conds], dtype=float)
+        lgw = np.where(need < has, has / need, 1.0)
+        return temperature_weights(needs, plant_conds, external_cond) * lgw
+
+
+def get_class(care_type: str) -> type:
+    """ Registered optimiser class of the care type, NoOpt if there is none. """
+    if Opt := CareOpt.registry.get(care_type):
+        return Opt
+    logger.debug(
+        """
+        Couldn't find a matching care optimizer.
+        Returning NoOpt.
+        """
+    )
+    return NoOpt
+
 
 def get(care_type: str):
-    if matches := list(filter(lambda x: x.care_type == care_type, CareOpt.__subclasses__())):
-        Opt = matches.pop()
-        return Opt()
-    else:
-        logger.debug(
-            """
-            Couldn't find a matching care optimizer.
-            Returning NoOpt.
-            """
-        )
-        return NoOpt()
+    return get_class(care_type)()
@@ -1,13 +1,22 @@
-import copy
 from abc import ABC, abstractmethod
 import datetime as dt
+import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
-from typing import Union, Tuple, List
+from typing import Union, Tuple, List, Dict, Optional
 import numpy as np
 
 from app.db.repertoire import PlantUnit
+from app.db.repertoire import SimulatedPlant
+from app.db.plans import PlanCache
+from app.db.plans import fingerprint
+from app.db.care import HistoryIndex
+from app.db.care import CareNeeds
+from app.db.utils import norm_species
 from plenty.climate import ClimateConditions
+from plenty.climate import normalize_location
+from plenty.climate import ClimateSeries
 from plenty.care import optimisers
 
 
@@ -27,6 +36,85 @@ def dates_to_binary(hist: List[dt.date],
     ]
 
 
+def dates_to_matrix(hists: List[List[dt.date]],
+                    from_date: dt.date,
+                    n_days: int
+                    ) -> np.ndarray:
+    """
+    Convert care histories of many plants into
+    a binary plants by days matrix.
+
+    Parameters
+    ----------
+    hists: List[List[date]]
+        care dates per plant
+    from_date: date
+        date of the first column
+    n_days: int
+        number of columns
+
+    Returns
+    -------
+    np.ndarray
+        (n_plants, n_days) matrix, 1 if cared on the day.
+    """
+    return _ordinals_to_matrix(
+        [[d.toordinal() for d in hist] for hist in hists],
+        from_date,
+        n_days
+    )
+
+
+def _ordinals_to_matrix(ordinals: List, from_date: dt.date, n_days: int) -> np.ndarray:
+    h = np.zeros((len(ordinals), n_days), dtype=np.int8)
+    origin = from_date.toordinal()
+    for row, o in enumerate(ordinals):
+        cols = np.asarray(o, dtype=np.int64) - origin
+        h[row, cols[(cols >= 0) & (cols < n_days)]] = 1
+    return h
+
+
+def _window_means(counts: np.ndarray, lookbacks: np.ndarray) -> np.ndarray:
+    """
+    Care counts over their lookback windows, rounded with the
+    python round of the per-plant planners; np.round differs
+    from it on some means, such as 1/80. Each distinct count
+    and lookback pair is rounded once.
+    """
+    pairs, inverse = np.unique(
+        np.stack([counts, np.maximum(lookbacks, 1)]).astype(np.int64), axis=1, return_inverse=True
+    )
+    means = np.array([round(int(c) / int(lb), 3) for c, lb in pairs.T], dtype=float)
+    return means[inverse.reshape(-1)]
+
+
+def care_types_of(needs: Dict) -> List[str]:
+    """ Care types with a care frequency in the plant needs. """
+    return [
+        care_type
+        for care_type, need in needs.items()
+        if isinstance(need, dict) and 'freq' in need
+    ]
+
+
+def location_of(plant: PlantUnit) -> Optional[Tuple]:
+    """ Location of the plant, None for the location of the user. """
+    return normalize_location(plant.conditions.get('location'))
+
+
+def _series_bytes(series: ClimateSeries) -> bytes:
+    return str(series.start).encode() + b''.join(
+        series.data[c].tobytes() for c in series.columns
+    )
+
+
+def _group_by_location(plants: List[PlantUnit]) -> Dict[Optional[Tuple], List[int]]:
+    groups = dict()
+    for row, plant in enumerate(plants):
+        groups.setdefault(location_of(plant), []).append(row)
+    return groups
+
+
 def _impute_detection(func):
     @wraps(func)
     def detect_and_run(h: List[int], *args, **kwargs):
@@ -68,6 +156,9 @@ class Planner(ABC):
 
     today = dt.date.today()
     lookback = 15
+    impute_factor = 1.0
+    # stochastic planners, like imputation, draw a new plan on every run, so their plans are never cached.
+    stochastic = False
 
     @classmethod
     @abstractmethod
@@ -87,6 +178,356 @@ class Planner(ABC):
         """
         pass
 
+    @classmethod
+    @abstractmethod
+    def decide(cls, mu: np.ndarray, last: np.ndarray, needs: np.ndarray) -> np.ndarray:
+        """
+        Vectorized care decision for many plants on a date.
+
+        Parameters
+        ----------
+        mu: np.ndarray
+            mean care of the lookback window per plant
+        last: np.ndarray
+            1 if plant was cared the day before, 0 if not.
+        needs: np.ndarray
+            care need per plant
+
+        Returns
+        -------
+        np.ndarray
+            1 if plant should be cared on care type, 0 if not.
+        """
+        pass
+
+    @classmethod
+    def lookbacks(cls, needs: np.ndarray) -> np.ndarray:
+        """ Lookback window length in days per plant. """
+        return np.full(needs.shape, cls.lookback, dtype=int)
+
+    @staticmethod
+    def needs(plants: List[PlantUnit],
+              care_type: str,
+              optimise: bool = True,
+              dates: List[dt.date] = None
+              ) -> np.ndarray:
+        """
+        Care needs of the plants, optimised for the climate
+        conditions of their location in one batch per location
+        if optimise is True. If dates are given, the needs are
+        optimised for the climate window of every date.
+
+        Returns
+        -------
+        np.ndarray
+            (n_plants,) needs, or (n_plants, n_dates) if dates are given.
+        """
+        freq = np.array(
+            [plant.needs.get(care_type, {}).get('freq', 0.05) for plant in plants],
+            dtype=float
+        )
+        if not optimise:
+            logger.debug('optimisation is off.')
+            return freq if dates is None else np.repeat(freq[:, None], len(dates), axis=1)
+        logger.debug('optimisation is on.')
+        opt = optimisers.get_class(care_type)
+        needs = freq.copy() if dates is None else np.zeros((len(plants), len(dates)))
+        for location, rows in _group_by_location(plants).items():
+            plant_needs = [plants[row].needs for row in rows]
+            plant_conds = [plants[row].conditions for row in rows]
+            if dates is None:
+                needs[rows] = opt.opt_batch(
+                    freq[rows], plant_needs, plant_conds, ClimateConditions.features(location)
+                )
+                continue
+            # days sharing a climate window share the optimised needs.
+            windows = dict()
+            for col, date in enumerate(dates):
+                features = ClimateConditions.features_at(date, location)
+                windows.setdefault(id(features), (features, []))[1].append(col)
+            for features, cols in windows.values():
+                needs[np.ix_(rows, cols)] = opt.opt_batch(
+                    freq[rows], plant_needs, plant_conds, features
+                )[:, None]
+        return needs
+
+    @classmethod
+    def need(cls,
+             plant: PlantUnit,
+             care_type: str,
+             optimise: bool = True,
+             date: dt.date = None
+             ) -> float:
+        """
+        Care need of the plant, optimised for the climate
+        conditions of the date if optimise is True.
+        """
+        if date is None:
+            return float(cls.needs([plant], care_type, optimise)[0])
+        return float(cls.needs([plant], care_type, optimise, [date])[0, 0])
+
+    @classmethod
+    def window(cls,
+               plant: PlantUnit,
+               care_type: str,
+               date: dt.date,
+               lookback: int,
+               need: float,
+               impute: bool = False
+               ) -> Tuple[float, int]:
+        """
+        Mean care of the lookback window before the date,
+        read from the care history index.
+
+        Parameters
+        ----------
+        plant: PlantUnit
+            plant
+        care_type: str
+            care type name
+        date: date
+            planned date, excluded from the window
+        lookback: int
+            window length in days
+        need: float
+            care need, used for imputation
+        impute: bool
+            apply imputation
+
+        Returns
+        -------
+        Tuple[float, int]
+            window mean, 1 if the plant was cared the day before.
+        """
+        index = plant.hist.index(care_type)
+        from_date = date - dt.timedelta(lookback)
+        if impute and not index.count(from_date, date):
+            h = random_factor_need_imputer([0] * lookback, need, cls.impute_factor)
+            if h:
+                return round(float(np.mean(h)), 3), h[-1]
+            return 0, 0
+        mu = round(index.mean(from_date, date), 3)
+        last = int(date - dt.timedelta(1) in index)
+        logger.debug(F'history : {index.count(from_date, date)} in {lookback} days')
+        return mu, last
+
+    @classmethod
+    def _impute_batch(cls, s, mu, last, lookbacks, needs):
+        empty = (s == 0) & (lookbacks > 0)
+        if not empty.any():
+            logger.debug('skipping imputation.')
+            return mu, last
+        logger.debug('applying imputation.')
+        rows = np.arange(len(needs))
+        width = int(lookbacks.max())
+        p = np.clip(needs * cls.impute_factor, 0, 1)
+        draws = np.random.binomial(1, p[:, None], (len(needs), width))
+        draws[np.arange(width) >= lookbacks[:, None]] = 0
+        imputed_mu = _window_means(draws.sum(axis=1), lookbacks)
+        imputed_last = draws[rows, np.maximum(lookbacks, 1) - 1]
+        return np.where(empty, imputed_mu, mu), np.where(empty, imputed_last, last)
+
+    @classmethod
+    def _history_matrix(cls,
+                        indexes: List[HistoryIndex],
+                        start_date: dt.date,
+                        n_days: int,
+                        needs: np.ndarray
+                        ) -> Tuple[np.ndarray, int]:
+        """
+        Care history matrix of the history indexes, wide enough
+        for the longest lookback window plus the planned days.
+
+        Returns
+        -------
+        Tuple[np.ndarray, int]
+            history matrix, column of the first planned day
+        """
+        offset = max(int(cls.lookbacks(needs).max(initial=0)), 1)
+        h = _ordinals_to_matrix(
+            [index.ordinals for index in indexes],
+            from_date=start_date + dt.timedelta(1 - offset),
+            n_days=offset + n_days
+        )
+        return h, offset
+
+    @classmethod
+    def _simulate(cls,
+                  h: np.ndarray,
+                  needs: np.ndarray,
+                  offset: int,
+                  impute: bool = False
+                  ) -> np.ndarray:
+        """
+        Advance the care schedules of all rows of the
+        history matrix one day at a time.
+
+        Parameters
+        ----------
+        h: np.ndarray
+            (n_plants, offset + n_days) binary care matrix,
+            updated in place with the planned care.
+        needs: np.ndarray
+            (n_plants, n_days) care need per plant and planned day
+        offset: int
+            column of the first planned day
+        impute: bool
+            apply imputation
+
+        Returns
+        -------
+        np.ndarray
+            (n_plants, n_days) care plan results
+        """
+        n_rows, n_days = h.shape[0], h.shape[1] - offset
+        rows = np.arange(n_rows)
+        lookbacks = cls.lookbacks(needs)
+        # prefix sums of the history, extended by a column per planned day.
+        cs = np.zeros((n_rows, h.shape[1] + 1), dtype=int)
+        cs[:, 1:offset + 1] = np.cumsum(h[:, :offset], axis=1)
+        results = np.zeros((n_rows, n_days), dtype=int)
+        for i in range(n_days):
+            t = offset + i
+            n, lb = needs[:, i], lookbacks[:, i]
+            s = cs[:, t] - cs[rows, t - lb]
+            mu = _window_means(s, lb)
+            last = h[:, t - 1].astype(int)
+            if impute and i > 0:  # don't impute the first day.
+                mu, last = cls._impute_batch(s, mu, last, lb, n)
+            res = cls.decide(mu, last, n)
+            h[:, t] |= res.astype(h.dtype)
+            cs[:, t + 1] = cs[:, t] + h[:, t]
+            results[:, i] = res
+        return results
+
+    @classmethod
+    def plan_batch(cls,
+                   plants: List[PlantUnit],
+                   care_type: str,
+                   start_date: dt.date = None,
+                   n_days: int = 10,
+                   optimise: bool = True,
+                   impute: bool = False,
+                   cache: bool = False
+                   ) -> Tuple[List, np.ndarray]:
+        """
+        Plan the care schedule of many plants for the next n days,
+        advancing all plants in a single vectorized step per day.
+
+        Parameters
+        ----------
+        plants: List[PlantUnit]
+            plants
+        care_type: str
+            care type name
+        start_date: date
+            start date
+        n_days: int
+            n days ahead to plan schedule
+        optimise: bool
+            optimise schedule
+        impute: bool
+            apply imputation
+        cache: bool
+            serve unchanged plants from the plan cache, ignored
+            by stochastic planners and when imputing
+
+        Returns
+        -------
+        Tuple[List[date], np.ndarray]
+            dates, (n_plants, n_days) care plan results
+        """
+        logger.info(F'running batch planner for {len(plants)} plants.')
+        if start_date is None:
+            start_date = cls.today
+        dates = [start_date + dt.timedelta(days=n_day) for n_day in range(1, n_days+1)]
+        needs = cls.needs(plants, care_type, optimise, dates)
+        h, offset = cls._history_matrix(
+            [plant.hist.index(care_type) for plant in plants], start_date, n_days, needs
+        )
+        random = cls.stochastic or impute
+        if cache and random:
+            logger.debug(F'{cls.planner_short_name} plans are drawn at random, not caching them.')
+        if not cache or random:
+            return dates, cls._simulate(h, needs, offset, impute=impute)
+
+        climate_hashes = {
+            location: fingerprint(_series_bytes(ClimateConditions.series(location)) if optimise else b'')
+            for location in _group_by_location(plants)
+        }
+        keys = [
+            (
+                plant.id,
+                care_type,
+                cls.planner_short_name,
+                str(start_date),
+                n_days,
+                fingerprint(h[row].tobytes()),
+                climate_hashes[location_of(plant)],
+                fingerprint([plant.needs, plant.conditions, optimise, impute])
+            )
+            for row, plant in enumerate(plants)
+        ]
+        cached = PlanCache.get(keys)
+        logger.info(F'{len(cached)} of {len(plants)} plans are served from cache.')
+        results = np.zeros((len(plants), n_days), dtype=int)
+        misses = [row for row, key in enumerate(keys) if key not in cached]
+        for row, key in enumerate(keys):
+            if key in cached:
+                results[row] = cached[key]
+        if misses:
+            results[misses] = cls._simulate(h[misses], needs[misses], offset, impute=impute)
+            PlanCache.add({keys[row]: results[row].tolist() for row in misses})
+        return dates, results
+
+    @classmethod
+    def plan_all(cls,
+                 plant: PlantUnit,
+                 start_date: dt.date = None,
+                 n_days: int = 10,
+                 optimise: bool = True,
+                 impute: bool = False
+                 ) -> Dict[str, Tuple[List, List]]:
+        """
+        Plan the care schedule of every care type in the
+        plant needs for the next n days in a single pass.
+
+        Parameters
+        ----------
+        plant: PlantUnit
+            plant
+        start_date: date
+            start date
+        n_days: int
+            n days ahead to plan schedule
+        optimise: bool
+            optimise schedule
+        impute: bool
+            apply imputation
+
+        Returns
+        -------
+        Dict[str, Tuple[List[date], List[int]]]
+            dates, care plan results per care type
+        """
+        care_types = care_types_of(plant.needs)
+        logger.info(F'running planner for care types: {care_types}')
+        if start_date is None:
+            start_date = cls.today
+        dates = [start_date + dt.timedelta(days=n_day) for n_day in range(1, n_days+1)]
+        needs = np.array(
+            [cls.needs([plant], care_type, optimise, dates)[0] for care_type in care_types],
+            dtype=float
+        ).reshape(len(care_types), n_days)
+        h, offset = cls._history_matrix(
+            [plant.hist.index(care_type) for care_type in care_types], start_date, n_days, needs
+        )
+        results = cls._simulate(h, needs, offset, impute=impute)
+        return {
+            care_type: (dates, results[row].tolist())
+            for row, care_type in enumerate(care_types)
+        }
+
     @classmethod
     def plan(cls,
              plant: PlantUnit,
@@ -124,13 +565,13 @@ class Planner(ABC):
             start_date = cls.today
         dates = list()
         results = list()
-        plant_copy = copy.deepcopy(plant)
+        sim_plant = SimulatedPlant(plant)
         for n_day in range(1, n_days+1):
             date = start_date + dt.timedelta(days=n_day)
             logger.debug(f'planning for {str(date)}')
 
             result = cls.step(
-                plant_copy,
+                sim_plant,
                 care_type,
                 date,
                 optimise=optimise,
@@ -138,9 +579,7 @@ class Planner(ABC):
                 )
 
             if result == 1:
-                plant_copy.hist.hist.append(
-                    (plant_copy.id, care_type, str(date))
-                )
+                sim_plant.hist.record(date, care_type)
 
             logger.debug(F'to {care_type}: {result}')
             dates.append(date)
@@ -148,37 +587,91 @@ class Planner(ABC):
         return dates, results
 
 
+class _HorizonMixin:
+    """
+    Long horizon planning for the deterministic lookback planners.
+    """
+
+    @classmethod
+    def plan_horizon(cls,
+                     plant: PlantUnit,
+                     care_type: str,
+                     start_date: dt.date = None,
+                     n_days: int = 365,
+                     optimise: bool = True
+                     ) -> Tuple[List, List]:
+        """
+        Plan the care schedule for the next n days with a
+        sliding window care counter instead of stepping
+        through the history every day. The schedule is
+        the same as plan without imputation.
+
+        Parameters
+        ----------
+        plant: PlantUnit
+            plant
+        care_type: str
+            care type name
+        start_date: date
+            start date
+        n_days: int
+            n days ahead to plan schedule
+        optimise: bool
+            optimise schedule
+
+        Returns
+        -------
+        Tuple[List[str], List[int]]
+            dates, care plan results
+        """
+        logger.info('running long horizon planner.')
+        if start_date is None:
+            start_date = cls.today
+        dates = [start_date + dt.timedelta(days=n_day) for n_day in range(1, n_days+1)]
+        needs = cls.needs([plant], care_type, optimise, dates)[0]
+        lookbacks = cls.lookbacks(needs)
+        offset = max(int(lookbacks.max(initial=0)), 1)
+        needs, lookbacks = needs.tolist(), lookbacks.tolist()
+        index = plant.hist.index(care_type)
+        origin = start_date.toordinal() + 1 - offset
+        h = bytearray(offset + n_days)
+        lo, hi = np.searchsorted(index.ordinals, [origin, origin + len(h)])
+        for o in index.ordinals[lo:hi]:
+            h[o - origin] = 1
+        # prefix care counts, filled in as the days are planned.
+        cs = [0] * (len(h) + 1)
+        for t in range(offset):
+            cs[t + 1] = cs[t] + h[t]
+        results = []
+        for i in range(n_days):
+            t, n, lookback = offset + i, needs[i], lookbacks[i]
+            mu = round((cs[t] - cs[t - lookback]) / lookback, 3) if lookback else 0
+            if mu < n:
+                result = 1
+            elif mu == n:
+                result = 1 - h[t - 1]
+            else:
+                result = 0
+            h[t] |= result
+            cs[t + 1] = cs[t] + h[t]
+            results.append(result)
+        return dates, results
+
+
 class Bernoulli(Planner):
     planner_short_name = 'bayes'
+    impute_factor = 0.8
+    stochastic = True
 
     @classmethod
     def step(cls, plant: PlantUnit, care_type: str, date: Union[dt.date], optimise=True, impute: bool = False):
         freq = plant.needs.get(care_type, {}).get('freq', 0.05)
-        if optimise:
-            excon = ClimateConditions.get()
-            logger.debug('optimisation is on.')
-            n = optimisers.get(care_type)\
-                .opt(freq, plant.needs, plant.conditions, excon)
-        else:
-            logger.debug('optimisation is off.')
-            n = freq
+        n = cls.need(plant, care_type, optimise, date)
 
-        h = dates_to_binary(
-            plant.hist(care_type),
-            from_date=date - dt.timedelta(cls.lookback),
-            to_date=date
-        )
+        mu, last = cls.window(plant, care_type, date, cls.lookback, n, impute=impute)
 
         logger.debug(F'need: {n}')
         logger.debug(F'frequency : {freq}')
-        logger.debug(F'history : {h}')
-        if impute:
-            h = random_factor_need_imputer(h, n, 0.8)
-        if h:
-            mu = np.mean(h)
-            mu = round(float(mu), 3)
-        else:
-            mu = 0
         p = min(max(n - mu, 0), 1)
         logger.debug(F'mu : {mu}')
         logger.debug(F'proba : {p}')
@@ -187,87 +680,121 @@ class Bernoulli(Planner):
         else:
             return int(p)
 
+    @classmethod
+    def decide(cls, mu: np.ndarray, last: np.ndarray, needs: np.ndarray) -> np.ndarray:
+        p = np.clip(needs - mu, 0, 1)
+        return np.random.binomial(1, p)
 
-class NaiveLookback(Planner):
+    @classmethod
+    def plan_ensemble(cls,
+                      plant: PlantUnit,
+                      care_type: str,
+                      start_date: dt.date = None,
+                      n_days: int = 10,
+                      n_samples: int = 1000,
+                      optimise: bool = True,
+                      impute: bool = False,
+                      threshold: float = 0.5
+                      ) -> Tuple[List, np.ndarray, List]:
+        """
+        Simulate many care trajectories of the plant at once
+        and summarise them into a single schedule.
+
+        Parameters
+        ----------
+        plant: PlantUnit
+            plant
+        care_type: str
+            care type name
+        start_date: date
+            start date
+        n_days: int
+            n days ahead to plan schedule
+        n_samples: int
+            number of simulated trajectories, at least 1
+        optimise: bool
+            optimise schedule
+        impute: bool
+            apply imputation
+        threshold: float
+            minimum care probability for the consensus schedule
+
+        Returns
+        -------
+        Tuple[List[date], np.ndarray, List[int]]
+            dates, care probability per day, consensus care plan results
+        """
+        if n_samples < 1:
+            raise ValueError(F'n_samples must be at least 1, not: {n_samples}')
+        logger.info(F'running ensemble planner with {n_samples} samples.')
+        if start_date is None:
+            start_date = cls.today
+        dates = [start_date + dt.timedelta(days=n_day) for n_day in range(1, n_days+1)]
+        needs = np.repeat(cls.needs([plant], care_type, optimise, dates), n_samples, axis=0)
+        h, offset = cls._history_matrix([plant.hist.index(care_type)], start_date, n_days, needs)
+        h = np.repeat(h, n_samples, axis=0)
+        results = cls._simulate(h, needs, offset, impute=impute)
+        proba = results.mean(axis=0)
+        schedule = (proba >= threshold).astype(int).tolist()
+        logger.debug(F'care probabilities : {proba}')
+        return dates, proba, schedule
+
+
+class NaiveLookback(_HorizonMixin, Planner):
     planner_short_name = 'naive'
 
     @classmethod
     def step(cls, plant: PlantUnit, care_type: str, date: Union[dt.date], optimise=True, impute: bool = False):
         freq = plant.needs.get(care_type, {}).get('freq', 0.05)
-        if optimise:
-            logger.debug('optimisation is on.')
-            excon = ClimateConditions.get()
-            n = optimisers.get(care_type) \
-                .opt(freq, plant.needs, plant.conditions, excon)
-        else:
-            logger.debug('optimisation is off.')
-            n = freq
+        n = cls.need(plant, care_type, optimise, date)
 
-        h = dates_to_binary(
-            plant.hist(care_type),
-            from_date=date - dt.timedelta(cls.lookback),
-            to_date=date
-        )
+        mu, last = cls.window(plant, care_type, date, cls.lookback, n, impute=impute)
 
         logger.debug(F'need: {n}')
         logger.debug(F'frequency : {freq}')
-        logger.debug(F'history : {h}')
-        if impute:
-            h = random_need_imputer(h, n)
-        if h:
-            mu = np.mean(h)
-            mu = round(float(mu), 3)
-        else:
-            mu = 0
         logger.debug(F'mu : {mu}')
         if mu < n:
             return 1
         elif mu == n:
-            return 1 - h[-1]
+            return 1 - last
         else:
             return 0
 
+    @classmethod
+    def decide(cls, mu: np.ndarray, last: np.ndarray, needs: np.ndarray) -> np.ndarray:
+        return np.where(mu < needs, 1, np.where(mu == needs, 1 - last, 0))
+
 
-class DynamicLookback(Planner):
+class DynamicLookback(_HorizonMixin, Planner):
     planner_short_name = 'dynamic'
 
     @classmethod
     def step(cls, plant: PlantUnit, care_type: str, date: Union[dt.date], optimise=True, impute: bool = False):
         freq = plant.needs.get(care_type, {}).get('freq', 0.05)
-        if optimise:
-            logger.debug('optimisation is on.')
-            excon = ClimateConditions.get()
-            n = optimisers.get(care_type) \
-                .opt(freq, plant.needs, plant.conditions, excon)
-        else:
-            logger.debug('optimisation is off.')
-            n = freq
+        n = cls.need(plant, care_type, optimise, date)
 
         lookback = round(1 / n)
-        h = dates_to_binary(
-            plant.hist(care_type),
-            from_date=date - dt.timedelta(lookback),
-            to_date=date
-        )
+        mu, last = cls.window(plant, care_type, date, lookback, n, impute=impute)
 
         logger.debug(F'need: {n}')
         logger.debug(F'frequency : {freq}')
-        logger.debug(F'history : {h}')
-        if impute:
-            h = random_need_imputer(h, n)
-        if h:
-            mu = np.mean(h)
-            mu = round(float(mu), 3)
-        else:
-            mu = 0
         logger.debug(F'mu : {mu}')
         if mu < n:
             return 1
         elif mu == n:
-            return 1 - h[-1]
+            return 1 - last
         else:
             return 0
 
+    @classmethod
+    def decide(cls, mu: np.ndarray, last: np.ndarray, needs: np.ndarray) -> np.ndarray:
+        return np.where(mu < needs, 1, np.where(mu == needs, 1 - last, 0))
+
+    @classmethod
+    def lookbacks(cls, needs: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore'):
+            return np.where(needs > 0, np.round(1 / needs), cls.lookback).astype(int)
+
 
 def get_planner(name):
     """
@@ -288,3 +815,113 @@ def get_planner(name):
         return res.pop()
     else:
         raise ValueError(F'no planner found with name : {name}')
+
+
+def _plan_chunk(planner_name: str,
+                rows: List[Tuple],
+                care_type: str,
+                start_date: dt.date,
+                n_days: int,
+                optimise: bool,
+                impute: bool,
+                cache: bool,
+                climate: Dict,
+                needs: Dict
+                ) -> np.ndarray:
+    """ Plan a chunk of repertoire rows in a worker process. """
+    np.random.seed()  # forked workers would otherwise share the parent's random state.
+    for location, (cond, series) in climate.items():
+        ClimateConditions.put(cond, location, series)
+    CareNeeds.data.update(needs)
+    plants = [
+        PlantUnit(plantae_id=row[0],
+                  name=row[1],
+                  conditions=json.loads(row[2]),
+                  species=row[3]
+                  )
+        for row in rows
+    ]
+    _, results = get_planner(planner_name).plan_batch(
+        plants,
+        care_type,
+        start_date=start_date,
+        n_days=n_days,
+        optimise=optimise,
+        impute=impute,
+        cache=cache
+    )
+    return results
+
+
+def plan_parallel(planner_name: str,
+                  rows: List[Tuple],
+                  care_type: str,
+                  start_date: dt.date = None,
+                  n_days: int = 10,
+                  optimise: bool = True,
+                  impute: bool = False,
+                  cache: bool = False,
+                  workers: int = 2
+                  ) -> Tuple[List, np.ndarray]:
+    """
+    Plan the care schedule of repertoire rows across a process pool.
+    The climate conditions and the care needs are loaded once here
+    and shipped to the workers, which build and plan their plants.
+
+    Parameters
+    ----------
+    planner_name: str
+        planner name
+    rows: List[Tuple]
+        repertoire rows, see app.db.repertoire.Repertoire.query
+    care_type: str
+        care type name
+    start_date: date
+        start date
+    n_days: int
+        n days ahead to plan schedule
+    optimise: bool
+        optimise schedule
+    impute: bool
+        apply imputation
+    cache: bool
+        serve unchanged plants from the plan cache
+    workers: int
+        number of worker processes
+
+    Returns
+    -------
+    Tuple[List[date], np.ndarray]
+        dates, (n_plants, n_days) care plan results in the order of the rows
+    """
+    planner = get_planner(planner_name)
+    if start_date is None:
+        start_date = planner.today
+    dates = [start_date + dt.timedelta(days=n_day) for n_day in range(1, n_days+1)]
+    locations = {normalize_location(json.loads(row[2]).get('location')) for row in rows}
+    climate = {
+        location: (ClimateConditions.get(location), ClimateConditions.series(location))
+        for location in (locations if optimise else [])
+    }
+    needs = {norm_species(row[3]): CareNeeds.get(row[3]) for row in rows}
+    chunks = [c.tolist() for c in np.array_split(np.arange(len(rows)), max(min(workers, len(rows)), 1))]
+    logger.info(F'planning {len(rows)} plants on {len(chunks)} workers.')
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _plan_chunk,
+                planner_name,
+                [rows[ix] for ix in chunk],
+                care_type,
+                start_date,
+                n_days,
+                optimise,
+                impute,
+                cache,
+                climate,
+                needs
+            )
+            for chunk in chunks
+        ]
+        results = [future.result() for future in futures]
+    return dates, np.concatenate(results)
@@ -1,9 +1,24 @@
+import os
+import asyncio
 import datetime
 import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union, Dict
+import numpy as np
+import pandas as pd
 import meteostat
 
 from plenty.api.openweathermap import get_point
-from plenty.utils import get_user_info
+from plenty.api.openweathermap import get_daily_history
+from plenty.utils import get_user_info, read_json
+from plenty.care.optimisers import mean_weighted_temperature
+from app.db.climate import ClimateCache
+from app.db.climate import ClimateHistory
+from app.db.climate import location_key
 
 
 # TODO: setup advanced adjustments from outdoor temp to indoor temp.
@@ -11,27 +26,94 @@ from plenty.utils import get_user_info
 logger = logging.getLogger("app.climate")
 
 
-# noinspection PyArgumentList
-def _fetch_daily_climate(end_time: datetime.time = None,
-                         days_back: int = 15
-                         ):
+def _user_location():
     ui = get_user_info()
     city, state_code, country_code = ui.get('city'), ui.get('state_code'), ui.get('country_code')
     if not any([city, state_code, country_code]):
         logger.debug('user has no location information.')
-    lat, lon = get_point(city, state_code, country_code)
-    point = meteostat.Point(lat, lon)
+    return city, state_code, country_code
+
+
+def normalize_location(location: Union[Tuple, list, dict, None]) -> Optional[Tuple]:
+    """
+    Location as a (city, state_code, country_code) tuple of
+    stripped lower case parts, None for the location of the user.
+    """
+    if not location:
+        return None
+    if isinstance(location, dict):
+        location = location.get('city'), location.get('state_code'), location.get('country_code')
+    parts = [part.strip().lower() or None if isinstance(part, str) else part for part in location]
+    return tuple(parts) + (None,) * (3 - len(parts))
+
+
+def _climate_window(end_time: datetime.datetime = None,
+                    days_back: int = 15
+                    ):
     if end_time is None:
         end_time = datetime.datetime.now()\
             .replace(hour=0, minute=0, second=0, microsecond=0)
+    return end_time - datetime.timedelta(days=days_back), end_time
+
+
+# noinspection PyArgumentList
+def _download_meteostat_daily(location: Tuple,
+                              start: datetime.datetime,
+                              end: datetime.datetime
+                              ):
+    lat, lon = get_point(*location)
+    point = meteostat.Point(lat, lon)
     daily_loader = meteostat.Daily(
         point,
-        end_time - datetime.timedelta(days=days_back),
-        end_time
+        start,
+        end
     )
     return daily_loader.fetch()
 
 
+def _download_openweathermap_daily(location: Tuple,
+                                   start: datetime.datetime,
+                                   end: datetime.datetime
+                                   ):
+    return get_daily_history(*location, start=start, end=end)
+
+
+CLIMATE_SOURCES = {
+    'meteostat': _download_meteostat_daily,
+    'openweathermap': _download_openweathermap_daily,
+}
+
+
+def _download_daily_climate(location: Tuple,
+                            start: datetime.datetime,
+                            end: datetime.datetime,
+                            source: str = 'meteostat'
+                            ):
+    if source not in CLIMATE_SOURCES:
+        raise ValueError(F'unknown climate source: {source}')
+    logger.debug(F'downloading daily climate from {source}.')
+    return CLIMATE_SOURCES[source](location, start, end)
+
+
+def _fetch_daily_climate(end_time: datetime.time = None,
+                         days_back: int = 15,
+                         location: Tuple = None,
+                         source: str = 'meteostat'
+                         ):
+    """
+    Daily climate of the window, read from the local climate
+    history after downloading only the days it doesn't have.
+    """
+    location = location or _user_location()
+    start, end = _climate_window(end_time, days_back)
+    key = location_key(location)
+    for gap in ClimateHistory.missing(key, start, end, source):
+        logger.debug(F'backfilling {source} climate data from {gap[0]} to {gap[1]}.')
+        data = _download_daily_climate(location, *gap, source=source)
+        ClimateHistory.add(key, data, *gap, source=source)
+    return ClimateHistory.get(key, start, end, source)
+
+
 def _estimate_indoor_temp_from_outdoor_temp(t: float):
     if t < 17:
         return 19.0
@@ -43,27 +125,313 @@ def _estimate_indoor_temp_from_outdoor_temp(t: float):
         return 20.0
 
 
+def _nan_reduce(func, values) -> Optional[float]:
+    arr = np.array(values if values is not None else [], dtype=float)
+    if not len(arr) or np.isnan(arr).all():
+        return None
+    return float(func(arr))
+
+
+@dataclass(frozen=True)
+class ClimateFeatures:
+    """
+    Immutable snapshot of the climate features the
+    optimisers use, computed once per climate fetch.
+    """
+    t_avg_ind: Optional[float] = None
+    t_avg: Optional[float] = None
+    t_min: Optional[float] = None
+    t_max: Optional[float] = None
+    t_sun: float = 0.0
+
+    @classmethod
+    def from_cond(cls, cond: dict) -> 'ClimateFeatures':
+        return cls(
+            t_avg_ind=mean_weighted_temperature(cond, indoor=True),
+            t_avg=mean_weighted_temperature(cond, indoor=False),
+            t_min=_nan_reduce(np.nanmin, cond.get('tmin')),
+            t_max=_nan_reduce(np.nanmax, cond.get('tmax')),
+            t_sun=_nan_reduce(np.nansum, cond.get('tsun')) or 0.0
+        )
+
+    def weighted_temperature(self, indoor=True) -> Optional[float]:
+        """ Recency weighted mean temperature. """
+        return self.t_avg_ind if indoor else self.t_avg
+
+
+class ClimateSeries:
+    """
+    Columnar, date-indexed daily climate. Each column is an
+    array with one value per day from the start date on, so
+    the climate window of any date is an O(1) array slice.
+    """
+    columns = ('tavg', 'tmin', 'tmax', 'tsun', 't_avg_ind')
+
+    def __init__(self, start: datetime.date, data: Dict[str, np.ndarray]):
+        self.start = start
+        self.data = data
+        self._features = dict()
+
+    def __len__(self):
+        return len(self.data['tavg'])
+
+    @property
+    def end(self) -> datetime.date:
+        return self.start + datetime.timedelta(days=len(self) - 1)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'ClimateSeries':
+        """ Series from daily climate indexed by date, missing days are NaN. """
+        if frame.empty:
+            return cls(datetime.date.today(), {c: np.array([]) for c in cls.columns})
+        index = pd.to_datetime(frame.index).normalize()
+        frame = frame.set_axis(index).sort_index()
+        frame = frame[~frame.index.duplicated(keep='last')]
+        frame = frame.reindex(
+            pd.date_range(index.min(), index.max(), freq='D'),
+            columns=list(cls.columns[:-1])
+        )
+        data = {c: frame[c].to_numpy(dtype=float) for c in cls.columns[:-1]}
+        data['t_avg_ind'] = np.select(
+            [data['tavg'] < 17, (data['tavg'] >= 25) & (data['tavg'] <= 28), data['tavg'] > 28],
+            [19.0, 21.0, 22.0],
+            20.0
+        )
+        return cls(frame.index[0].date(), data)
+
+    def window(self, date: datetime.date, days: int) -> Dict[str, np.ndarray]:
+        """ Climate of the days up to and including the date, clamped to the series. """
+        hi = min(date.toordinal() - self.start.toordinal() + 1, len(self))
+        lo = min(max(hi - days, 0), max(hi, 0))
+        return {c: arr[lo:max(hi, 0)] for c, arr in self.data.items()}
+
+    def features_at(self, date: datetime.date, days: int) -> ClimateFeatures:
+        """ Feature snapshot of the window of the date, computed once per window. """
+        hi = min(date.toordinal() - self.start.toordinal() + 1, len(self))
+        key = (max(hi - days, 0), max(hi, 0))
+        if key not in self._features:
+            self._features[key] = ClimateFeatures.from_cond(self.window(date, days))
+        return self._features[key]
+
+
+class ForecastProvider(ABC):
+    """
+    Source of the daily climate forecast of the planned days.
+    """
+
+    @abstractmethod
+    def forecast(self,
+                 location: Tuple,
+                 start: datetime.date,
+                 end: datetime.date
+                 ) -> pd.DataFrame:
+        """
+        Daily tavg, tmin, tmax and tsun forecast from start
+        to end, both included, indexed by date.
+        """
+        pass
+
+
+class FileForecastProvider(ForecastProvider):
+    """
+    Forecast read from a local json file mapping dates
+    to daily climate, e.g. {"2022-06-01": {"tavg": 18.2}}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def forecast(self, location, start, end):
+        days = read_json(self.path)
+        frame = pd.DataFrame.from_dict(days, orient='index')
+        if frame.empty:
+            return frame
+        frame.index = pd.to_datetime(frame.index)
+        return frame[
+            (frame.index >= pd.Timestamp(start)) & (frame.index <= pd.Timestamp(end))
+        ]
+
+
 class ClimateConditions:
+    """
+    Climate conditions per location, kept in a bounded
+    least recently used map of per-location snapshots.
+    The location None stands for the location of the user.
+
+    Loading is single-flight: while the conditions of a
+    location are being fetched, concurrent callers wait on
+    the same fetch instead of starting their own.
+    """
     days_back = 15
-    cond = None
+    ttl = datetime.timedelta(hours=6)
+    max_locations = 32
+    snapshots = OrderedDict()
+    forecast_provider: Optional[ForecastProvider] = None
+    forecast_days = 30
+    source = 'meteostat'
+    _lock = threading.RLock()
+    _inflight: Dict[Tuple, Future] = dict()
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """
+        Forget the loads in flight in a forked child, their
+        loader threads only exist in the parent process.
+        """
+        cls._lock = threading.RLock()
+        cls._inflight = dict()
+
+    @classmethod
+    def put(cls, cond: dict, location: Tuple = None, series: ClimateSeries = None):
+        """ Keep the climate conditions of the location. """
+        location = normalize_location(location)
+        with cls._lock:
+            cls.snapshots[location] = [cond, None, series]
+            cls.snapshots.move_to_end(location)
+            while len(cls.snapshots) > cls.max_locations:
+                evicted, _ = cls.snapshots.popitem(last=False)
+                logger.debug(F'evicting climate data of {evicted}.')
 
     @classmethod
-    def get(cls):
-        if cls.cond is None:
-            logger.debug('climate data does not exist.')
-            data = _fetch_daily_climate()
-            if data.empty:
-                logger.warning('climate data returned empty response!')
-                cls.cond = {}
-            else:
-                cond = data[['tavg', 'tmin', 'tmax', 'tsun']]\
-                    .sort_index(ascending=True)\
-                    .to_dict(orient='list')
-                cond['t_avg_ind'] = list(map(
-                    lambda x: _estimate_indoor_temp_from_outdoor_temp(x),
-                    cond['tavg']
-                ))
-                cls.cond = cond
+    def _snapshot(cls, location: Optional[Tuple]) -> list:
+        """
+        Snapshot of the normalized location, kept again if it was
+        evicted by another thread after being loaded.
+        """
+        cond = cls.get(location)
+        with cls._lock:
+            if location not in cls.snapshots:
+                cls.put(cond, location)
+            return cls.snapshots[location]
+
+    @classmethod
+    def features(cls, location: Tuple = None) -> ClimateFeatures:
+        """ Feature snapshot of the climate conditions, computed once per fetch. """
+        location = normalize_location(location)
+        snapshot = cls._snapshot(location)
+        if snapshot[1] is None:
+            logger.debug('computing climate features.')
+            features = ClimateFeatures.from_cond(snapshot[0])
+            with cls._lock:
+                if snapshot[1] is None:
+                    snapshot[1] = features
+        return snapshot[1]
+
+    @classmethod
+    def series(cls, location: Tuple = None) -> ClimateSeries:
+        """
+        Date-indexed climate of the location, the observed days
+        followed by the forecast of the forecast provider.
+        """
+        location = normalize_location(location)
+        snapshot = cls._snapshot(location)
+        cond = snapshot[0]
+        if snapshot[2] is None:
+            logger.debug('building climate series.')
+            _, end = _climate_window(days_back=cls.days_back)
+            times = cond.get('time') or [
+                end - datetime.timedelta(days=i)
+                for i in reversed(range(len(cond.get('tavg', []))))
+            ]
+            frame = pd.DataFrame(
+                {c: cond.get(c, []) for c in ClimateSeries.columns[:-1]},
+                index=pd.to_datetime(times),
+                dtype=float
+            )
+            if cls.forecast_provider is not None:
+                start = (frame.index.max() if not frame.empty else pd.Timestamp(end)).date() \
+                    + datetime.timedelta(days=1)
+                forecast = cls.forecast_provider.forecast(
+                    location or _user_location(),
+                    start,
+                    start + datetime.timedelta(days=cls.forecast_days)
+                )
+                frame = pd.concat([frame, forecast.reindex(columns=frame.columns)])
+            series = ClimateSeries.from_frame(frame)
+            with cls._lock:
+                if snapshot[2] is None:
+                    snapshot[2] = series
+        return snapshot[2]
+
+    @classmethod
+    def features_at(cls, date: datetime.date, location: Tuple = None) -> ClimateFeatures:
+        """ Feature snapshot of the climate window of the date. """
+        return cls.series(location).features_at(date, cls.days_back + 1)
+
+    @classmethod
+    def get(cls, location: Tuple = None):
+        location = normalize_location(location)
+        with cls._lock:
+            if location in cls.snapshots:
+                logger.info('climate data exists, returning existing data.')
+                cls.snapshots.move_to_end(location)
+                return cls.snapshots[location][0]
+            future = cls._inflight.get(location)
+            loading = future is None
+            if loading:
+                future = cls._inflight[location] = Future()
+        if not loading:
+            logger.debug(F'waiting for the climate data of {location} being loaded.')
+            return future.result()
+        try:
+            cond = cls._load(location)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(cond)
+            return cond
+        finally:
+            with cls._lock:
+                cls._inflight.pop(location, None)
+
+    @classmethod
+    async def aget(cls, location: Tuple = None):
+        """
+        Climate conditions of the location, loaded in
+        the default executor of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, cls.get, location)
+
+    @classmethod
+    def prefetch(cls, location: Tuple = None) -> threading.Thread:
+        """ Start loading the climate conditions of the location in the background. """
+        def _prefetch():
+            try:
+                cls.get(location)
+            except Exception as e:
+                logger.warning(F'climate data prefetch failed: {e}')
+        thread = threading.Thread(target=_prefetch, name='climate-prefetch', daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def _load(cls, location: Tuple):
+        logger.debug(F'climate data does not exist for {location}.')
+        start, end = _climate_window(days_back=cls.days_back)
+        key = ClimateCache.key(location or _user_location(), start, end, cls.source)
+        if (cond := ClimateCache.get(key, cls.ttl)) is not None:
+            logger.info('climate data is served from the climate cache.')
+            cls.put(cond, location)
+            return cond
+        data = _fetch_daily_climate(end, cls.days_back, location, cls.source)
+        if data.empty:
+            logger.warning('climate data returned empty response!')
+            cond = {}
         else:
-            logger.info('climate data exists, returning existing data.')
-        return cls.cond
+            data = data.sort_index(ascending=True)
+            cond = data[['tavg', 'tmin', 'tmax', 'tsun']]\
+                .to_dict(orient='list')
+            cond['time'] = [t.strftime('%Y-%m-%d') for t in data.index]
+            cond['t_avg_ind'] = list(map(
+                lambda x: _estimate_indoor_temp_from_outdoor_temp(x),
+                cond['tavg']
+            ))
+            ClimateCache.add(key, cond)
+        cls.put(cond, location)
+        return cond
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ClimateConditions._reset_after_fork)
@@ -1,15 +1,27 @@
 import os
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, List, Optional
 import logging
 
 from plenty.api.plantnet import get_prediction
 from plenty.models.utils import with_images_check
-from plenty.utils import read_img_binary
 from plenty.models.utils import format_prediction_response
+from plenty.models.utils import downscale_image
+from plenty.models.utils import needs_downscale
+from app.db.species import PredictionCache
 
 
 # uploaded images path
 IMAGES_PATH = './tmp/images/'
+# uploaded images are downscaled to this long edge and jpeg quality
+UPLOAD_LONG_EDGE = 1280
+UPLOAD_JPEG_QUALITY = 85
+# images resized at once by a prediction
+UPLOAD_WORKERS = 4
+# plantnet identifies at most this many images per request
+MAX_IMAGES_PER_REQUEST = 5
+REQUEST_WORKERS = 4
 
 logger = logging.getLogger('app.models.species')
 
@@ -24,16 +36,10 @@ class PredictionFailureException(Exception):
 
 
 @with_images_check
-def load_images(path):
-    logger.info('loading images from path.')
-    images = []
-    image_paths = []
-    for key in os.listdir(path):
-        image_path = os.path.join(path, key)
-        image = read_img_binary(image_path)
-        images.append(image)
-        image_paths.append(image_path)
-    return image_paths, images
+def list_images(path):
+    """ Paths of the images in the path, read only when they are used. """
+    logger.info('listing images from path.')
+    return [os.path.join(path, key) for key in os.listdir(path)]
 
 
 def _parse_response_results(r: Dict):
@@ -45,22 +51,118 @@ def _parse_response_results(r: Dict):
     }
 
 
-def predict(response_type='best', **kwargs):
+def fuse_results(group_results: List[List[Dict]], rule: str = 'max') -> List[Dict]:
+    """
+    Fuse the parsed results of the image groups into
+    one list, ranked by the fused score.
+
+    Parameters
+    ----------
+    group_results: List[List[Dict]]
+        parsed prediction results of each image group
+    rule: str
+        max: the highest score of the species in any group.
+        mean: the mean score of the species over all groups,
+            a group not predicting the species scores 0.
+
+    Returns
+    -------
+    List[Dict]
+        parsed prediction results, highest fused score first.
+    """
+    if rule not in ('max', 'mean'):
+        raise ValueError(F'fusion rule can be max or mean, not: {rule}')
+    fused = dict()
+    for results in group_results:
+        for r in results:
+            name = r['scientificName']
+            if name not in fused:
+                fused[name] = {**r, 'proba': 0.0}
+            if rule == 'max':
+                fused[name]['proba'] = max(fused[name]['proba'], r['proba'])
+            else:
+                fused[name]['proba'] += r['proba'] / len(group_results)
+    return sorted(fused.values(), key=lambda r: r['proba'], reverse=True)
+
+
+def _upload_source(image_path: str, resizer: Optional[ThreadPoolExecutor]):
+    """
+    Upload content and file name of the image. An image to
+    downscale is re-encoded on the resizer pool, its upload
+    part waits for it when it is sent.
+    """
+    if resizer is not None and needs_downscale(image_path, UPLOAD_LONG_EDGE):
+        return (
+            resizer.submit(downscale_image, image_path, UPLOAD_LONG_EDGE, UPLOAD_JPEG_QUALITY).result,
+            os.path.splitext(image_path)[0] + '.jpg'
+        )
+    return image_path, image_path
+
+
+def _predict_group(image_paths: List[str], resizer: Optional[ThreadPoolExecutor] = None) -> List[Dict]:
+    images, names = zip(*[_upload_source(path, resizer) for path in image_paths])
+    res, success = get_prediction(list(images), ['leaf'] * len(images), list(names))
+    if not success:
+        logger.error(F'prediction failed: {res}')
+        raise PredictionFailureException(res)
+    return [_parse_response_results(r) for r in res.get('results', [])]
+
+
+def predict(response_type='best', refresh=False, downscale=False, fusion='max', **kwargs):
+    """
+    Species prediction of the images in the path.
+
+    Predictions are cached by the content of the images,
+    the same images are not sent to the api again unless
+    a refresh is forced. The images are sent in groups of
+    at most MAX_IMAGES_PER_REQUEST, concurrently, and the
+    results of the groups are fused into one ranking.
+
+    Parameters
+    ----------
+    response_type: str
+        {best, topn}
+    refresh: bool
+        request the prediction even if it is cached.
+    downscale: bool
+        downscale the images to jpeg before uploading them,
+        on UPLOAD_WORKERS threads shared by the groups.
+    fusion: str
+        {max, mean}, rule fusing the scores of the image groups.
+    **kwargs
+        path: images path, topn: number of results of topn.
+
+    Returns
+    -------
+    List[Dict]
+        parsed prediction results
+    """
     logger.info('inside species prediction method.')
     path = kwargs.get('path', None)
     if path is None:
         logger.debug('path is not given.')
         path = IMAGES_PATH
-    image_paths, images = load_images(path)
-    organs = ['leaf'] * len(images)
-    res, success = get_prediction(images, organs, image_paths)
-    if success:
-        return format_prediction_response(
-            res,
-            response_type,
-            response_map_func=_parse_response_results,
-            **kwargs
-        )
+    image_paths = list_images(path)
+    if not isinstance(image_paths, list) or not image_paths:
+        raise PredictionFailureException(F'there are no images to detect in {path}.')
+    organs = ['leaf'] * len(image_paths)
+    key = PredictionCache.key(image_paths, organs, fusion)
+    if not refresh and (results := PredictionCache.get(key)) is not None:
+        logger.info('species prediction is served from the cache.')
     else:
-        logger.error(F'prediction failed: {res}')
-        raise PredictionFailureException(res)
+        groups = [
+            image_paths[i:i + MAX_IMAGES_PER_REQUEST]
+            for i in range(0, len(image_paths), MAX_IMAGES_PER_REQUEST)
+        ]
+        logger.debug(F'requesting predictions of {len(image_paths)} images in {len(groups)} groups.')
+        # one resizer pool for all groups bounds the images decoded at once.
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) if downscale else nullcontext() as resizer, \
+                ThreadPoolExecutor(max_workers=max(1, min(REQUEST_WORKERS, len(groups)))) as executor:
+            group_results = list(executor.map(lambda group: _predict_group(group, resizer), groups))
+        results = fuse_results(group_results, fusion)
+        PredictionCache.add(key, results)
+    return format_prediction_response(
+        {'results': results},
+        response_type,
+        **kwargs
+    )
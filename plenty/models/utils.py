@@ -1,8 +1,10 @@
+import io
 import os
 import logging
 import time
 from functools import wraps
-from typing import List, Dict
+from typing import List, Dict, Union
+from PIL import Image, ImageOps
 
 
 logger = logging.getLogger('app.models.utils')
@@ -81,3 +83,60 @@ def find_latest_model_version(model_path: str):
             could not find any versions. please check the path.
             """
         )
+
+
+def _open_image(image: Union[bytes, str]) -> Image.Image:
+    return Image.open(image if isinstance(image, (str, os.PathLike)) else io.BytesIO(image))
+
+
+def _needs_downscale(img: Image.Image, long_edge: int) -> bool:
+    return max(img.size) > long_edge or img.getexif().get(0x0112, 1) != 1
+
+
+def needs_downscale(image: Union[bytes, str], long_edge: int = 1280) -> bool:
+    """
+    Whether the image is larger than the long edge or not
+    upright, read from its header without decoding it.
+    """
+    try:
+        with _open_image(image) as img:
+            return _needs_downscale(img, long_edge)
+    except (OSError, TypeError, ValueError, Image.DecompressionBombError):
+        return False
+
+
+def downscale_image(image: Union[bytes, str], long_edge: int = 1280, quality: int = 85) -> Union[bytes, str]:
+    """
+    Image re-encoded as jpeg with its exif orientation applied
+    and its long edge downsized to at most long_edge pixels.
+
+    Images already within the long edge and upright are kept
+    as they are, images that can't be decoded are returned as is.
+
+    Parameters
+    ----------
+    image: bytes, str
+        encoded image or its path
+    long_edge: int
+        maximum length of the longer side in pixels
+    quality: int
+        jpeg quality of the re-encoded image
+
+    Returns
+    -------
+    bytes, str
+        encoded image, or the given image if it is kept.
+    """
+    try:
+        with _open_image(image) as img:
+            if not _needs_downscale(img, long_edge):
+                return image
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((long_edge, long_edge), Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True)
+    except (OSError, TypeError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(F'image could not be downscaled: {e}')
+        return image
+    logger.debug(F'image downscaled to {buffer.tell()} bytes.')
+    return buffer.getvalue()
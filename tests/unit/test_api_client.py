@@ -0,0 +1,213 @@
+import io
+import json
+import time
+import email.parser
+import threading
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from plenty.api.client import ApiClient
+from plenty.api.client import RateLimiter
+from plenty.api.client import MultipartBody
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    ports = []
+    bodies = []
+
+    def _respond(self):
+        self.ports.append(self.client_address[1])
+        self.bodies.append(self._read_body())
+        status = self.statuses.pop(0) if self.statuses else 200
+        status, headers = status if isinstance(status, tuple) else (status, {})
+        body = json.dumps({'status': status}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = b''
+        while size := int(self.rfile.readline().strip(), 16):
+            data += self.rfile.read(size)
+            self.rfile.readline()
+        self.rfile.readline()
+        return data
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandInHandler.statuses, StandInHandler.ports, StandInHandler.bodies = [], [], []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield F'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client():
+    client = ApiClient('stand-in', timeout=2, retries=2, backoff=0.01)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def post_client():
+    client = ApiClient('stand-in', timeout=2, retries=2, backoff=0.01, retry_methods=['GET', 'POST'])
+    yield client
+    client.close()
+
+
+def test_client_keep_alive(server, client):
+    for _ in range(3):
+        assert client.get(server + '/geo?appid=secret').status_code == 200
+    assert len(set(StandInHandler.ports)) == 1
+    stats = client.stats['GET 127.0.0.1:' + server.rsplit(':', 1)[1] + '/geo']
+    assert stats.count == 3 and stats.errors == 0 and stats.mean_ms > 0
+
+
+def test_client_retries(server, post_client):
+    StandInHandler.statuses = [503, 429]
+    res = post_client.post(server + '/identify', data=b'body')
+    assert res.status_code == 200
+    assert StandInHandler.bodies == [b'body'] * 3
+    stats = post_client.stats[post_client.endpoint('POST', server + '/identify')]
+    assert stats.count == 3 and stats.retries == 2 and stats.errors == 2
+
+
+def test_client_no_post_retry_by_default(server, client):
+    StandInHandler.statuses = [503]
+    assert client.post(server + '/identify', data=b'body').status_code == 503
+    assert len(StandInHandler.bodies) == 1
+
+
+def test_client_post_retries_unprocessed(server, client, image_file):
+    StandInHandler.statuses = [429, (503, {'Retry-After': '0'})]
+    body = MultipartBody(fields=[('organs', 'leaf')], files=[('images', 'a.jpg', image_file)])
+    res = client.post(server + '/identify', data=body, headers={'Content-Type': body.content_type})
+    assert res.status_code == 200
+    assert len(StandInHandler.bodies) == 3
+    assert StandInHandler.bodies[0] == StandInHandler.bodies[2]
+
+
+def test_client_retries_rewind_files(server, post_client):
+    StandInHandler.statuses = [503]
+    files = [('images', ('a.jpg', io.BytesIO(b'leaf-a'))), ('images', ('b.jpg', io.BytesIO(b'leaf-b')))]
+    assert post_client.post(server + '/identify', files=files).status_code == 200
+    assert len(StandInHandler.bodies) == 2
+    assert all(b'leaf-a' in body and b'leaf-b' in body for body in StandInHandler.bodies)
+
+
+def test_client_retries_exhausted(server, client):
+    StandInHandler.statuses = [500, 500, 500, 500]
+    assert client.get(server + '/history').status_code == 500
+    assert len(StandInHandler.ports) == 3
+
+
+def test_client_no_retry_on_client_error(server, client):
+    StandInHandler.statuses = [400]
+    assert client.get(server + '/history').status_code == 400
+    assert len(StandInHandler.ports) == 1
+
+
+def test_client_timeout(client):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('http://127.0.0.1:9/unreachable')
+    assert client.stats['GET 127.0.0.1:9/unreachable'].count == 3
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=50)
+    t0 = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - t0 >= 4 / 50
+
+
+def _parse_multipart(content_type, data):
+    msg = email.parser.BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + data
+    )
+    return [
+        (part.get_param('name', header='content-disposition'), part.get_filename(), part.get_payload(decode=True))
+        for part in msg.get_payload()
+    ]
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'leaf.jpg'
+    path.write_bytes(b'leaf' * 50000)
+    return str(path)
+
+
+def test_multipart_body(image_file):
+    body = MultipartBody(
+        fields=[('organs', 'leaf'), ('organs', 'flower')],
+        files=[('images', 'a.jpg', image_file), ('images', 'b.jpg', b'flower'), ('images', 'c.jpg', io.BytesIO(b'bark'))]
+    )
+    assert body._open is None
+    data = body.read(50)
+    assert body._open is None
+    while chunk := body.read(8192):
+        assert len(chunk) <= 8192
+        data += chunk
+    assert len(data) == len(body)
+    assert body._open is None
+    assert _parse_multipart(body.content_type, data) == [
+        ('organs', None, b'leaf'),
+        ('organs', None, b'flower'),
+        ('images', 'a.jpg', b'leaf' * 50000),
+        ('images', 'b.jpg', b'flower'),
+        ('images', 'c.jpg', b'bark'),
+    ]
+    body.seek(0)
+    assert body.read() == data
+
+
+def test_multipart_body_retried(server, post_client, image_file):
+    StandInHandler.statuses = [503]
+    body = MultipartBody(fields=[('organs', 'leaf')], files=[('images', 'a.jpg', image_file)])
+    res = post_client.post(server + '/identify', data=body, headers={'Content-Type': body.content_type})
+    assert res.status_code == 200
+    assert len(StandInHandler.bodies) == 2
+    assert StandInHandler.bodies[0] == StandInHandler.bodies[1]
+    assert _parse_multipart(body.content_type, StandInHandler.bodies[1])[1] == ('images', 'a.jpg', b'leaf' * 50000)
+
+
+def test_multipart_body_lazy_part(server, post_client):
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return b'resized'
+
+    body = MultipartBody(fields=[('organs', 'leaf')], files=[('images', 'a.jpg', produce)])
+    assert len(body) == 0
+    assert body.read(10) and calls == []
+    StandInHandler.statuses = [503]
+    body.seek(0)
+    res = post_client.post(server + '/identify', data=body, headers={'Content-Type': body.content_type})
+    assert res.status_code == 200
+    assert len(calls) == 2
+    assert body._open is None
+    assert StandInHandler.bodies[0] == StandInHandler.bodies[1]
+    assert _parse_multipart(body.content_type, StandInHandler.bodies[1])[1] == ('images', 'a.jpg', b'resized')
+    with pytest.raises(io.UnsupportedOperation):
+        body.seek(5)
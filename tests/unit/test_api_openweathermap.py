@@ -1,12 +1,20 @@
 import pytest
 from mock import patch
 import datetime as dt
+import numpy as np
 import pandas as pd
 
 from plenty.api.openweathermap import process_history_req_input
 from plenty.api.openweathermap import geocoding_req
 from plenty.api.openweathermap import history_req
 from plenty.api.openweathermap import get_point
+from plenty.api.openweathermap import get_history
+from plenty.api.openweathermap import history_windows
+from plenty.api.openweathermap import history_to_daily
+from plenty.api.openweathermap import get_daily_history
+from plenty.api.openweathermap import get_points
+from plenty.api.openweathermap import HistoryRequestError
+from app.db.geocodes import Geocodes
 
 
 class MockResponse:
@@ -80,7 +88,7 @@ def test_process_history_req_input(lat, lon, start, days_back):
 
 
 @patch('plenty.api.util.get_api_key')
-@patch('requests.get')
+@patch('requests.Session.request')
 def test_geocoding_req(mock_request_get,
                        mock_utils_get_api_key,
                        apikey,
@@ -95,7 +103,7 @@ def test_geocoding_req(mock_request_get,
 
 
 @patch('plenty.api.util.get_api_key')
-@patch('requests.get')
+@patch('requests.Session.request')
 def test_history_req(mock_request_get,
                      mock_utils_get_api_key,
                      hist_success_response,
@@ -112,19 +120,19 @@ def test_history_req(mock_request_get,
 
 
 @patch('plenty.api.openweathermap.save_geocode_response')
-@patch('plenty.api.openweathermap.read_json')
+@patch('plenty.api.openweathermap.lookup_geocode')
 @patch('plenty.api.util.get_api_key')
-@patch('requests.get')
+@patch('requests.Session.request')
 def test_get_point_saved(mock_request_get,
                          mock_utils_get_api_key,
-                         mock_read_json,
+                         mock_lookup,
                          mock_save,
                          apikey,
                          geo_success_response,
                          lat,
                          lon
                          ):
-    mock_read_json.return_value = {'Utrecht,NL': [10.2000, 10.3000]}
+    mock_lookup.return_value = (10.2000, 10.3000)
     mock_save.return_value = None
     mock_utils_get_api_key.return_value = apikey
     mock_request_get.return_value = geo_success_response
@@ -133,21 +141,148 @@ def test_get_point_saved(mock_request_get,
 
 
 @patch('plenty.api.openweathermap.save_geocode_response')
-@patch('plenty.api.openweathermap.read_json')
+@patch('plenty.api.openweathermap.lookup_geocode')
 @patch('plenty.api.util.get_api_key')
-@patch('requests.get')
+@patch('requests.Session.request')
 def test_get_point_unsaved(mock_request_get,
                            mock_utils_get_api_key,
-                           mock_read_json,
+                           mock_lookup,
                            mock_save,
                            apikey,
                            geo_success_response,
                            lat,
                            lon
                            ):
-    mock_read_json.return_value = {}
+    mock_lookup.return_value = None
     mock_save.return_value = None
     mock_utils_get_api_key.return_value = apikey
     mock_request_get.return_value = geo_success_response
     lat, lon = get_point('Utrecht', None, 'NL')
     assert lat == 10.0 and lon == 10.0
+
+
+def test_history_windows():
+    day = 24 * 3600
+    windows = history_windows(10 * day + 5, 24 * day, window_days=7)
+    assert windows == [(7 * day, 14 * day), (14 * day, 21 * day), (21 * day, 24 * day)]
+    assert history_windows(5, 5) == []
+
+
+def _window_response(method, url, **kwargs):
+    params = dict(p.split('=') for p in url.split('?')[1].split('&'))
+    start, end = int(params['start']), int(params['end'])
+    return MockResponse({'list': [{'dt': t, 'main': {'temp': 20.0}} for t in range(start, end, 3600)]}, 200)
+
+
+@patch('plenty.api.util.get_api_key', return_value='00apikey')
+@patch('plenty.api.openweathermap.get_point', return_value=(10.0, 10.0))
+@patch('requests.Session.request', side_effect=_window_response)
+def test_get_history_windows(mock_request, mock_get_point, mock_get_api_key, tmp_path, monkeypatch, start):
+    monkeypatch.chdir(tmp_path)
+    records = get_history('Utrecht', None, 'NL', start=start, days_back=30)
+    times = [r['dt'] for r in records]
+    assert times == sorted(set(times))
+    assert times[0] == start.timestamp() - 30 * 24 * 3600
+    assert times[-1] == start.timestamp() - 3600
+    assert mock_request.call_count == 5
+    get_history('Utrecht', None, 'NL', start=start, days_back=30)
+    assert mock_request.call_count == 6
+
+
+
+@patch('plenty.api.util.get_api_key', return_value='00apikey')
+@patch('plenty.api.openweathermap.get_point', return_value=(10.0, 10.0))
+@patch('requests.Session.request')
+def test_get_history_failed_window(mock_request, mock_get_point, mock_get_api_key, tmp_path, monkeypatch, start):
+    monkeypatch.chdir(tmp_path)
+    end = int(start.timestamp())
+    failed = history_windows(end - 30 * 24 * 3600, end)[1][0]
+    mock_request.side_effect = lambda method, url, **kwargs: MockResponse({}, 401) \
+        if F'&start={failed}&' in url else _window_response(method, url)
+    with pytest.raises(HistoryRequestError):
+        get_history('Utrecht', None, 'NL', start=start, days_back=30)
+
+
+@patch('plenty.api.util.get_api_key', return_value='00apikey')
+@patch('plenty.api.openweathermap.get_point', return_value=(10.0, 10.0))
+@patch('requests.Session.request')
+def test_get_history_partial_window_not_cached(mock_request, mock_get_point, mock_get_api_key, tmp_path,
+                                               monkeypatch, start):
+    monkeypatch.chdir(tmp_path)
+
+    def _truncated(method, url, **kwargs):
+        res = _window_response(method, url)
+        res.json_data['list'] = res.json_data['list'][:24]
+        return res
+    mock_request.side_effect = _truncated
+    get_history('Utrecht', None, 'NL', start=start, days_back=14, workers=1)
+    calls = mock_request.call_count
+    mock_request.side_effect = _window_response
+    get_history('Utrecht', None, 'NL', start=start, days_back=14, workers=1)
+    assert mock_request.call_count == 2 * calls
+    get_history('Utrecht', None, 'NL', start=start, days_back=14, workers=1)
+    assert mock_request.call_count == 2 * calls + 1
+
+
+@pytest.fixture
+def hourly_records(start):
+    t0 = int(start.timestamp())
+    return [
+        {
+            'dt': t0 + h * 3600,
+            'main': {'temp': 10.0 + h, 'temp_min': 9.0 + h, 'temp_max': 11.0 + h},
+            'clouds': {'all': 50},
+            'weather': [{'icon': '04d' if 8 <= h % 24 < 20 else '04n'}]
+        }
+        for h in range(48)
+    ]
+
+
+def test_history_to_daily(hourly_records):
+    daily = history_to_daily(hourly_records[::-1])
+    assert list(daily.columns) == ['tavg', 'tmin', 'tmax', 'tsun']
+    assert list(daily.index) == [pd.Timestamp(2022, 7, 27), pd.Timestamp(2022, 7, 28)]
+    assert daily['tavg'].tolist() == [21.5, 45.5]
+    assert daily['tmin'].tolist() == [9.0, 33.0]
+    assert daily['tmax'].tolist() == [34.0, 58.0]
+    assert daily['tsun'].tolist() == [360.0, 360.0]
+
+
+def test_history_to_daily_missing_fields():
+    daily = history_to_daily([{'dt': 0, 'main': {'temp': 10.0}}, {'dt': 3600, 'main': {}}])
+    assert daily['tavg'].tolist() == [10.0]
+    assert daily['tmin'].tolist() == [10.0]
+    assert np.isnan(daily['tsun'].iloc[0])
+    assert history_to_daily([]).empty
+
+
+@patch('plenty.api.openweathermap.get_history')
+def test_get_daily_history(mock_get_history, hourly_records):
+    mock_get_history.return_value = hourly_records
+    daily = get_daily_history('Utrecht', None, 'NL', dt.datetime(2022, 7, 28), dt.datetime(2022, 7, 28))
+    assert list(daily.index) == [pd.Timestamp(2022, 7, 28)]
+    assert mock_get_history.call_args.kwargs == {'start': dt.datetime(2022, 7, 29), 'days_back': 1}
+
+
+def _geocode(city, state_code=None, country_code=None):
+    if city == 'Atlantis':
+        return {}, False
+    return {'lat': float(len(city)), 'lon': 1.0}, True
+
+
+@patch('plenty.api.openweathermap.geocoding_req', side_effect=_geocode)
+def test_get_points(mock_geocoding_req, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'store').mkdir()
+    Geocodes.add({'Utrecht,NL': (52.09, 5.12)})
+    points = get_points([
+        ('Utrecht', None, 'NL'),
+        ('Berlin', None, 'DE'),
+        ('berlin ', None, 'de'),
+        ('Atlantis', None, None),
+    ], rate=None)
+    assert points == [(52.09, 5.12), (6.0, 1.0), (6.0, 1.0), (None, None)]
+    assert mock_geocoding_req.call_count == 2
+    assert Geocodes.get('Berlin,DE') == (6.0, 1.0)
+    get_points([('Berlin', None, 'DE')])
+    assert mock_geocoding_req.call_count == 2
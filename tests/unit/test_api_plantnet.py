@@ -65,19 +65,19 @@ def test_get_api_endpoint(mock_utils_get_api_key, apikey):
 
 
 @patch('plenty.api.util.get_api_key')
-@patch('requests.post')
+@patch('requests.Session.request')
 def test_get_prediction(mock_request, mock_utils_get_api_key, success_response):
     mock_utils_get_api_key.return_value = apikey
     mock_request.return_value = success_response
-    r, success = get_prediction([None], ['leaf'], [None])
+    r, success = get_prediction([b'leaf'], ['leaf'], [None])
     assert success
     assert r['results'][0]['score'] == 1
 
 
 @patch('plenty.api.util.get_api_key', return_value='invalid-value')
-@patch('requests.post')
+@patch('requests.Session.request')
 def test_get_prediction(mock_request, mock_utils_get_api_key, failed_response):
     mock_request.return_value = failed_response
-    r, success = get_prediction([None], ['leaf'], [None])
+    r, success = get_prediction([b'leaf'], ['leaf'], [None])
     assert not success
     assert r == dict()
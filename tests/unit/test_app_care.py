@@ -50,3 +50,20 @@ def test_care_needs_get(needs):
     CareNeeds.data = needs
     n = CareNeeds.get('macaroni')
     assert n['water']['freq'] == 0.15
+
+
+def test_history_index(history):
+    index = history.index('water')
+    assert len(index) == 2
+    assert dt.date(2022, 5, 24) in index
+    assert index.count(dt.date(2022, 5, 20), dt.date(2022, 5, 29)) == 1
+    assert index.count(dt.date(2022, 5, 20), dt.date(2022, 5, 30)) == 2
+    assert index.mean(dt.date(2022, 5, 20), dt.date(2022, 5, 30)) == 0.2
+
+
+def test_history_record_updates_index(history):
+    index = history.index('water')
+    history.record(dt.date(2022, 5, 26), 'water')
+    history.record('2022-05-26', 'water')
+    assert index.count(dt.date(2022, 5, 20), dt.date(2022, 5, 30)) == 3
+    assert dt.date(2022, 5, 26) in history('water')
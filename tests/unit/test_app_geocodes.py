@@ -0,0 +1,33 @@
+import json
+import pytest
+
+from app.db.geocodes import Geocodes
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'store').mkdir()
+    return tmp_path
+
+
+def test_geocodes_key():
+    assert Geocodes.key(' Utrecht, ,NL ') == 'utrecht,nl'
+
+
+def test_geocodes_add_get(store):
+    assert Geocodes.get('Utrecht,NL') is None
+    Geocodes.add({'Utrecht,NL': (52.09, 5.12), 'Berlin,DE': (52.52, 13.40)})
+    Geocodes.add({'utrecht,nl': (0.0, 0.0)})
+    assert Geocodes.get('UTRECHT, NL') == (52.09, 5.12)
+    assert Geocodes.get('Berlin,DE') == (52.52, 13.40)
+
+
+def test_geocodes_migrate(store):
+    path = store / 'store' / 'geocodes.json'
+    path.write_text(json.dumps({'Utrecht,NL': [52.09, 5.12]}))
+    Geocodes.migrate(str(path))
+    assert Geocodes.get('utrecht,nl') == (52.09, 5.12)
+    path.write_text(json.dumps({'Berlin,DE': [52.52, 13.40]}))
+    Geocodes.migrate(str(path))
+    assert Geocodes.get('Berlin,DE') is None
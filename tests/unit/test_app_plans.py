@@ -0,0 +1,84 @@
+import pytest
+import mock
+import datetime as dt
+
+from app.db.plans import PlanCache
+from app.db.plans import fingerprint
+from app.db.repertoire import PlantUnit
+from app.db.care import CareHistory
+from app.db.taxonomy import PlantTaxonomy
+from plenty.care import planners
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'store').mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def key():
+    return ('guacamole', 'water', 'naive', '2022-05-30', 3, 'h', 'c', 'n')
+
+
+@pytest.fixture
+def plant():
+    hist = [
+        ('guacamole', 'water', '2022-05-24'),
+        ('guacamole', 'water', '2022-05-29'),
+    ]
+    with mock.patch.object(CareHistory, 'query', return_value=hist):
+        with mock.patch('app.db.CareNeeds.get', return_value={'water': {'freq': 0.2}}):
+            with mock.patch.object(PlantTaxonomy, 'query', return_value=None):
+                yield PlantUnit('guacamole', 'guacamole', {}, species='guacamole')
+
+
+def test_fingerprint():
+    assert fingerprint({'a': 1, 'b': 2}) == fingerprint({'b': 2, 'a': 1})
+    assert fingerprint(b'1') != fingerprint(b'0')
+
+
+def test_plan_cache(store, key):
+    assert PlanCache.get([key]) == {}
+    PlanCache.add({key: [0, 1, 0]})
+    assert PlanCache.get([key]) == {key: [0, 1, 0]}
+    PlanCache.invalidate('guacamole')
+    assert PlanCache.get([key]) == {}
+
+
+def test_plan_batch_cache(store, plant):
+    planner = planners.get_planner('naive')
+    run_date = dt.date(2022, 5, 30)
+    _, results = planner.plan_batch([plant], 'water', start_date=run_date, optimise=False, cache=True)
+    with mock.patch.object(planner, '_simulate') as mock_simulate:
+        _, cached = planner.plan_batch([plant], 'water', start_date=run_date, optimise=False, cache=True)
+        mock_simulate.assert_not_called()
+    assert cached.tolist() == results.tolist()
+
+
+@pytest.mark.parametrize('planner_name, impute', [('bayes', False), ('naive', True), ('dynamic', True)])
+def test_plan_batch_cache_stochastic(store, plant, planner_name, impute):
+    planner = planners.get_planner(planner_name)
+    run_date = dt.date(2022, 5, 30)
+    with mock.patch.object(PlanCache, 'add') as mock_add:
+        planner.plan_batch([plant], 'water', start_date=run_date, optimise=False, impute=impute, cache=True)
+        mock_add.assert_not_called()
+    with mock.patch.object(planner, '_simulate', wraps=planner._simulate) as mock_simulate:
+        planner.plan_batch([plant], 'water', start_date=run_date, optimise=False, impute=impute, cache=True)
+        mock_simulate.assert_called_once()
+
+
+def test_plan_cache_replaces_plan_of_plant(store, key):
+    newer = key[:3] + ('2022-05-31',) + key[4:]
+    PlanCache.add({key: [0, 1, 0]})
+    PlanCache.add({newer: [1, 0, 0]})
+    assert PlanCache.get([key, newer]) == {newer: [1, 0, 0]}
+
+
+def test_plan_cache_many_plants(store, key):
+    keys = [(str(i),) + key[1:] for i in range(1200)]
+    PlanCache.add({k: [i % 2] for i, k in enumerate(keys)})
+    cached = PlanCache.get(keys + [('missing',) + key[1:]])
+    assert len(cached) == 1200
+    assert cached[keys[7]] == [1]
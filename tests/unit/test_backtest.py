@@ -0,0 +1,50 @@
+import pytest
+import mock
+import numpy as np
+
+from app.db.repertoire import PlantUnit
+from app.db.care import CareHistory
+from app.db.taxonomy import PlantTaxonomy
+from plenty.care.backtest import backtest
+from plenty.care.backtest import agreement_metrics
+
+
+@pytest.fixture()
+def hist():
+    return [
+        ('guacamole', 'water', '2022-05-01'),
+        ('guacamole', 'water', '2022-05-06'),
+        ('guacamole', 'water', '2022-05-11'),
+        ('guacamole', 'water', '2022-05-16'),
+        ('guacamole', 'water', '2022-05-21'),
+        ('guacamole', 'mist', '2022-05-23')
+    ]
+
+
+@pytest.fixture
+def plant(hist):
+    with mock.patch.object(CareHistory, 'query', return_value=hist):
+        with mock.patch('app.db.CareNeeds.get', return_value={'water': {'freq': 0.2}}):
+            with mock.patch.object(PlantTaxonomy, 'query', return_value=None):
+                yield PlantUnit('guacamole', 'guacamole', {}, species='guacamole')
+
+
+def test_agreement_metrics():
+    m = agreement_metrics(np.array([1, 0, 1, 0]), np.array([1, 0, 0, 1]))
+    assert m['agreement'] == 0.5
+    assert m['precision'] == 0.5
+    assert m['recall'] == 0.5
+
+
+def test_backtest(plant):
+    report = backtest([plant], 'water', planner_names=['naive', 'dynamic'])
+    assert list(report) == ['naive', 'dynamic']
+    for metrics in report.values():
+        assert metrics['n_plans'] == 21
+        assert 0 <= metrics['agreement'] <= 1
+        assert metrics['logged_rate'] == 5 / 21
+        assert metrics['p99_latency_ms'] >= metrics['p50_latency_ms']
+
+
+def test_backtest_without_history(plant):
+    assert backtest([plant], 'dust') == {}
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import threading
+import asyncio
+import pytest
+import mock
+import datetime as dt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from plenty.climate import ClimateConditions
+from plenty.climate import ClimateFeatures
+from plenty.climate import ClimateSeries
+from plenty.climate import FileForecastProvider
+from plenty.climate import _climate_window
+from plenty.climate import _fetch_daily_climate
+from app.db.climate import ClimateCache
+from app.db.climate import ClimateHistory
+from app.db.climate import location_key
+from plenty.care import optimisers
+
+
+@pytest.fixture
+def cond():
+    return {
+        'tavg': [12.0, 14.0, 13.0],
+        'tmin': [8.0, np.nan, 9.0],
+        'tmax': [16.0, 19.0, 17.0],
+        'tsun': [120.0, np.nan, 60.0],
+        't_avg_ind': [19.0, 19.0, 21.0]
+    }
+
+
+@pytest.fixture
+def needs():
+    return {
+        'air': {'temperature': {'min': 15, 'max': 26}},
+        'water': {'freq': 0.15}
+    }
+
+
+def test_climate_features(cond):
+    features = ClimateFeatures.from_cond(cond)
+    assert features.t_min == 8.0
+    assert features.t_max == 19.0
+    assert features.t_sun == 180.0
+    assert features.weighted_temperature(indoor=True) == optimisers.mean_weighted_temperature(cond, True)
+    assert features.weighted_temperature(indoor=False) == optimisers.mean_weighted_temperature(cond, False)
+
+
+def test_climate_features_empty():
+    features = ClimateFeatures.from_cond({})
+    assert features.t_avg_ind is None
+    assert features.t_sun == 0.0
+
+
+def test_climate_conditions_features(cond):
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()):
+        ClimateConditions.put(cond)
+        features = ClimateConditions.features()
+        assert ClimateConditions.features() is features
+
+
+def test_climate_conditions_per_location(cond):
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()), \
+            mock.patch.object(ClimateConditions, 'max_locations', 2):
+        ClimateConditions.put(cond, {'city': 'Utrecht', 'country_code': 'NL'})
+        ClimateConditions.put({}, ('Lisbon', None, 'PT'))
+        assert ClimateConditions.get(('Utrecht', None, 'NL')) is cond
+        ClimateConditions.put({}, ('Oslo',))
+        assert list(ClimateConditions.snapshots) == [('utrecht', None, 'nl'), ('oslo', None, None)]
+        assert ClimateConditions.get((' utrecht', '', 'nl ')) is cond
+
+
+def test_climate_conditions_features_evicted(cond):
+    def get(location=None):
+        cls.snapshots.clear()
+        return cond
+    cls = ClimateConditions
+    with mock.patch.object(cls, 'snapshots', OrderedDict()), \
+            mock.patch.object(cls, 'get', side_effect=get):
+        assert cls.features(('Utrecht',)).t_max == 19.0
+        assert cls.series(('Utrecht',)).data['tavg'].tolist() == cond['tavg']
+
+
+def test_opt_batch_with_features(cond, needs):
+    features = ClimateFeatures.from_cond(cond)
+    opt = optimisers.get_class('water')
+    assert opt.opt_batch(np.array([0.15]), [needs], [{}], features).tolist() == \
+        opt.opt_batch(np.array([0.15]), [needs], [{}], cond).tolist()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'store').mkdir()
+    return tmp_path
+
+
+def test_climate_cache(store, cond):
+    key = ClimateCache.key(('Utrecht', None, 'NL'), dt.datetime(2022, 5, 15), dt.datetime(2022, 5, 30))
+    assert key == 'utrecht,nl:2022-05-15:2022-05-30'
+    assert ClimateCache.get(key, dt.timedelta(hours=1)) is None
+    ClimateCache.add(key, cond)
+    assert ClimateCache.get(key, dt.timedelta(hours=1))['tavg'] == cond['tavg']
+    assert ClimateCache.get(key, dt.timedelta(0)) is None
+    ClimateCache.add(key, {})
+    assert ClimateCache.get(key, dt.timedelta(hours=1)) == {}
+    with mock.patch.object(ClimateCache, 'max_age', dt.timedelta(0)):
+        ClimateCache.add('lisbon,pt:2022-05-15:2022-05-30', cond)
+    assert ClimateCache.query(key) is None
+
+
+def test_climate_history_replaces_days(store):
+    days = pd.date_range('2022-05-15', periods=3, freq='D')
+    ClimateHistory.add('utrecht,nl', pd.DataFrame({'tavg': [12.0, 14.0, 13.0]}, index=days))
+    ClimateHistory.add('utrecht,nl', pd.DataFrame({'tavg': [15.0]}, index=days[1:2]))
+    ClimateHistory.add('utrecht,nl', pd.DataFrame({'tavg': [9.0]}, index=days[1:2]), source='openweathermap')
+    assert ClimateHistory.get('utrecht,nl', days[0], days[-1])['tavg'].tolist() == [12.0, 15.0, 13.0]
+    assert ClimateHistory.get('utrecht,nl', days[0], days[-1], 'openweathermap')['tavg'].tolist() == [9.0]
+
+
+@mock.patch('plenty.climate._user_location', return_value=('Utrecht', None, 'NL'))
+@mock.patch('plenty.climate._fetch_daily_climate')
+def test_climate_conditions_from_cache(mock_fetch, mock_location, store, cond):
+    start, end = _climate_window(days_back=ClimateConditions.days_back)
+    ClimateCache.add(ClimateCache.key(('Utrecht', None, 'NL'), start, end), cond)
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()):
+        assert ClimateConditions.get()['tmax'] == cond['tmax']
+    mock_fetch.assert_not_called()
+
+
+def test_climate_conditions_single_flight(cond):
+    def _load(location):
+        time.sleep(0.1)
+        ClimateConditions.put(cond, location)
+        return cond
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()), \
+            mock.patch.object(ClimateConditions, '_load', side_effect=_load) as mock_load:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: ClimateConditions.get(), range(8)))
+        assert all(r is cond for r in results)
+        mock_load.assert_called_once()
+        assert not ClimateConditions._inflight
+
+
+def test_climate_conditions_single_flight_error(cond):
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()), \
+            mock.patch.object(ClimateConditions, '_load', side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            ClimateConditions.get()
+        assert not ClimateConditions._inflight
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_climate_conditions_fork_during_load(cond):
+    parent, loading, release = os.getpid(), threading.Event(), threading.Event()
+
+    def _load(location):
+        if os.getpid() == parent:
+            loading.set()
+            release.wait(5)
+        ClimateConditions.put(cond, location)
+        return cond
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()), \
+            mock.patch.object(ClimateConditions, '_load', side_effect=_load):
+        thread = ClimateConditions.prefetch()
+        assert loading.wait(5) and ClimateConditions._inflight
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if ClimateConditions.get() == cond else 1)
+        try:
+            for _ in range(500):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    break
+                time.sleep(0.01)
+            else:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                pytest.fail('forked child blocked on the load of the parent.')
+            assert os.waitstatus_to_exitcode(status) == 0
+        finally:
+            release.set()
+            thread.join()
+
+
+def test_climate_conditions_aget(cond):
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()):
+        ClimateConditions.put(cond, ('Utrecht', None, 'NL'))
+
+        async def _main():
+            return await asyncio.gather(
+                ClimateConditions.aget(('Utrecht', None, 'NL')),
+                asyncio.sleep(0, result='repertoire')
+            )
+        assert asyncio.run(_main()) == [cond, 'repertoire']
+
+
+def _daily(location, start, end, source='meteostat'):
+    index = pd.date_range(start, end, freq='D', name='time')
+    return pd.DataFrame(
+        {'tavg': 15.0, 'tmin': 10.0, 'tmax': 20.0, 'prcp': 0.0, 'tsun': np.nan},
+        index=index
+    )
+
+
+@mock.patch('plenty.climate._download_daily_climate', side_effect=_daily)
+def test_fetch_daily_climate_backfill(mock_download, store):
+    location = ('Utrecht', None, 'NL')
+    data = _fetch_daily_climate(dt.datetime(2022, 5, 30), 15, location)
+    assert len(data) == 16
+    assert list(data.columns) == ['tavg', 'tmin', 'tmax', 'tsun']
+    mock_download.assert_called_once_with(
+        location, dt.datetime(2022, 5, 15), dt.datetime(2022, 5, 30), source='meteostat'
+    )
+    data = _fetch_daily_climate(dt.datetime(2022, 5, 31), 15, location)
+    assert len(data) == 16
+    assert data.index[-1] == pd.Timestamp(2022, 5, 31)
+    mock_download.assert_called_with(
+        location, dt.datetime(2022, 5, 31), dt.datetime(2022, 5, 31), source='meteostat'
+    )
+    _fetch_daily_climate(dt.datetime(2022, 5, 31), 15, location)
+    assert mock_download.call_count == 2
+
+
+@pytest.fixture
+def forecast_path(tmp_path):
+    path = tmp_path / 'forecast.json'
+    path.write_text(json.dumps({
+        '2022-06-01': {'tavg': 30.0, 'tmin': 25.0, 'tmax': 35.0, 'tsun': 600.0},
+        '2022-06-02': {'tavg': 31.0, 'tmin': 26.0, 'tmax': 36.0, 'tsun': 620.0},
+    }))
+    return str(path)
+
+
+
+def _daily_with_hole(location, start, end, source='meteostat'):
+    data = _daily(location, start, end, source)
+    return data.drop(pd.Timestamp(2022, 5, 20), errors='ignore')
+
+
+@mock.patch('plenty.climate._download_daily_climate', side_effect=_daily_with_hole)
+def test_fetch_daily_climate_station_gap(mock_download, store):
+    location = ('Utrecht', None, 'NL')
+    data = _fetch_daily_climate(dt.datetime(2022, 5, 30), 15, location)
+    assert len(data) == 15
+    assert pd.Timestamp(2022, 5, 20) not in data.index
+    _fetch_daily_climate(dt.datetime(2022, 5, 30), 15, location)
+    mock_download.assert_called_once()
+
+
+@mock.patch('plenty.climate._download_daily_climate')
+def test_fetch_daily_climate_unpublished_days(mock_download, store):
+    location = ('Utrecht', None, 'NL')
+    today = dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    mock_download.side_effect = lambda loc, start, end, source: _daily(loc, start, end - dt.timedelta(days=1))
+    _fetch_daily_climate(today, 15, location)
+    mock_download.side_effect = _daily
+    _fetch_daily_climate(today, 15, location)
+    mock_download.assert_called_with(location, today, today, source='meteostat')
+    ClimateHistory.add(location_key(location), pd.DataFrame(), today - dt.timedelta(days=1), today)
+    assert ClimateHistory.missing(location_key(location), today - dt.timedelta(days=15), today) == [
+        (today - dt.timedelta(days=1), today)
+    ]
+
+
+@pytest.fixture
+def observed(cond):
+    return {**cond, 'time': ['2022-05-29', '2022-05-30', '2022-05-31']}
+
+
+def test_climate_series_window(observed):
+    series = ClimateSeries.from_frame(
+        pd.DataFrame({c: observed[c] for c in ['tavg', 'tmin', 'tmax', 'tsun']},
+                     index=pd.to_datetime(observed['time']))
+    )
+    assert series.start == dt.date(2022, 5, 29)
+    assert series.end == dt.date(2022, 5, 31)
+    assert series.window(dt.date(2022, 5, 30), 2)['tavg'].tolist() == [12.0, 14.0]
+    assert series.window(dt.date(2022, 6, 30), 2)['tavg'].tolist() == [14.0, 13.0]
+    assert len(series.window(dt.date(2022, 5, 1), 2)['tavg']) == 0
+    assert series.features_at(dt.date(2022, 6, 30), 2) is series.features_at(dt.date(2022, 6, 1), 2)
+
+
+def test_climate_series_with_forecast(observed, forecast_path):
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()), \
+            mock.patch.object(ClimateConditions, 'forecast_provider', FileForecastProvider(forecast_path)), \
+            mock.patch('plenty.climate._user_location', return_value=('Utrecht', None, 'NL')):
+        ClimateConditions.put(observed)
+        series = ClimateConditions.series()
+        assert series.end == dt.date(2022, 6, 2)
+        assert series.data['t_avg_ind'].tolist() == [19.0, 19.0, 19.0, 22.0, 22.0]
+        assert ClimateConditions.features_at(dt.date(2022, 6, 2)).t_max == 36.0
+
+
+@mock.patch('plenty.climate._download_daily_climate', side_effect=_daily)
+def test_fetch_daily_climate_per_source(mock_download, store):
+    location = ('Utrecht', None, 'NL')
+    _fetch_daily_climate(dt.datetime(2022, 5, 30), 15, location, 'meteostat')
+    data = _fetch_daily_climate(dt.datetime(2022, 5, 30), 15, location, 'openweathermap')
+    assert len(data) == 16
+    mock_download.assert_called_with(
+        location, dt.datetime(2022, 5, 15), dt.datetime(2022, 5, 30), source='openweathermap'
+    )
+    assert mock_download.call_count == 2
+    assert ClimateCache.key(location, dt.datetime(2022, 5, 15), dt.datetime(2022, 5, 30), 'openweathermap') \
+        != ClimateCache.key(location, dt.datetime(2022, 5, 15), dt.datetime(2022, 5, 30))
@@ -1,5 +1,6 @@
 import mock
 import pytest
+import numpy as np
 
 from plenty.care import optimisers
 
@@ -94,3 +95,48 @@ def test_mist_opt(plant_cond,
 
     )
     assert round(res, 2) == needs['mist']['freq']
+
+
+@pytest.fixture
+def climate():
+    return {
+        'tavg': [12.0, 14.0, 13.0],
+        't_avg_ind': [19.0, 19.0, 21.0]
+    }
+
+
+@pytest.mark.parametrize('care_type', ['water', 'mist', 'dust'])
+def test_opt_batch_matches_opt(needs, plant_cond, climate, care_type):
+    outdoor_cond = {**plant_cond, 'indoor': False, 'light': {'score': 0.9}}
+    res = optimisers.get_class(care_type).opt_batch(
+        np.array([needs[care_type]['freq']] * 2),
+        [needs, needs],
+        [plant_cond, outdoor_cond],
+        climate
+    )
+    assert res.shape == (2,)
+    for r, cond in zip(res, [plant_cond, outdoor_cond]):
+        assert r == pytest.approx(
+            optimisers.get(care_type).opt(needs[care_type]['freq'], needs, cond, climate)
+        )
+
+
+def test_opt_batch_optimal_temperature(needs, plant_cond):
+    res = optimisers.get_class('water').opt_batch(
+        np.array([0.15]), [needs], [plant_cond], {'tavg': [], 't_avg_ind': []}
+    )
+    assert res.tolist() == [0.15]
+
+
+def test_get_class_registry():
+    assert optimisers.get_class('water') is optimisers.WaterOpt
+    assert optimisers.get_class('dust') is optimisers.NoOpt
+
+
+@pytest.mark.parametrize('care_type', ['water', 'mist'])
+@pytest.mark.parametrize('t_avg_ind', [[], [20.5] * 3, [20.0] * 3, [20.45] * 3])
+def test_opt_near_optimal_temperature(needs, plant_cond, care_type, t_avg_ind):
+    opt = optimisers.get(care_type)
+    res = opt.opt(needs[care_type]['freq'], needs, plant_cond, {'tavg': [], 't_avg_ind': t_avg_ind})
+    assert opt.base_tmw == 1.0
+    assert np.isfinite(res)
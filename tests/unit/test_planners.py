@@ -1,11 +1,22 @@
 import mock
 import pytest
+import functools
+import multiprocessing
 import datetime as dt
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 
 from app.db.repertoire import PlantUnit
 from plenty.care import planners
 from plenty.care.planners import dates_to_binary
+from plenty.care.planners import dates_to_matrix
 from app.db.care import CareHistory
+from plenty.climate import ClimateConditions
+from plenty.climate import ClimateSeries
+from app.db.taxonomy import PlantTaxonomy
 
 
 @pytest.fixture
@@ -68,10 +79,26 @@ def needs():
 def plant(plantae_id, plant_name, plant_cond, hist, needs):
     with mock.patch.object(CareHistory, 'query', return_value=hist):
         with mock.patch('app.db.CareNeeds.get', return_value=needs):
-            yield PlantUnit(plantae_id,
-                            plant_name,
-                            plant_cond
-                            )
+            with mock.patch.object(PlantTaxonomy, 'query', return_value=None):
+                yield PlantUnit(plantae_id,
+                                plant_name,
+                                plant_cond,
+                                species=plant_name
+                                )
+
+
+@pytest.fixture
+def plants(plant, plant_cond):
+    hist = [
+        ('avocado', 'water', '2022-05-21'),
+        ('avocado', 'water', '2022-05-27'),
+        ('avocado', 'water', '2022-05-28'),
+    ]
+    needs = {'water': {'freq': 0.3}}
+    with mock.patch.object(CareHistory, 'query', return_value=hist):
+        with mock.patch('app.db.CareNeeds.get', return_value=needs):
+            with mock.patch.object(PlantTaxonomy, 'query', return_value=None):
+                yield [plant, PlantUnit(1, 'avocado', plant_cond, species='avocado')]
 
 
 def test_dates_to_binary(plant, run_date, needs):
@@ -108,3 +135,184 @@ def test_dynamic_planner_step(plant, run_date, needs):
         impute=False
     )
     assert binary_response == 0
+
+
+def test_dates_to_matrix(plant, run_date):
+    h = dates_to_matrix(
+        [plant.hist('water'), []],
+        from_date=run_date - dt.timedelta(10),
+        n_days=10
+    )
+    assert h.shape == (2, 10)
+    assert h[0].tolist() == [0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+    assert not h[1].any()
+
+
+@pytest.mark.parametrize('planner_name', ['naive', 'dynamic'])
+def test_plan_batch_matches_plan(plants, run_date, planner_name):
+    planner = planners.get_planner(planner_name)
+    dates, results = planner.plan_batch(
+        plants,
+        'water',
+        start_date=run_date,
+        n_days=30,
+        optimise=False
+    )
+    assert results.shape == (2, 30)
+    for plant, plant_results in zip(plants, results):
+        plant_dates, plant_plan = planner.plan(
+            plant,
+            'water',
+            start_date=run_date,
+            n_days=30,
+            optimise=False
+        )
+        assert plant_dates == dates
+        assert plant_results.tolist() == plant_plan
+
+
+def test_bernoulli_plan_batch(plants, run_date):
+    planner = planners.get_planner('bayes')
+    dates, results = planner.plan_batch(
+        plants,
+        'water',
+        start_date=run_date,
+        n_days=10,
+        optimise=False,
+        impute=True
+    )
+    assert len(dates) == 10
+    assert results.shape == (2, 10)
+    assert set(results.flatten().tolist()) <= {0, 1}
+
+
+def test_plan_leaves_plant_history_untouched(plant, run_date):
+    n_rows = len(plant.hist.hist)
+    planner = planners.get_planner('naive')
+    _, results = planner.plan(plant, 'water', start_date=run_date, n_days=10, optimise=False)
+    assert any(results)
+    assert len(plant.hist.hist) == n_rows
+    assert len(plant.hist.index('water')) == 2
+
+
+def test_bernoulli_plan_ensemble(plant, run_date):
+    planner = planners.get_planner('bayes')
+    dates, proba, schedule = planner.plan_ensemble(
+        plant,
+        'water',
+        start_date=run_date,
+        n_days=10,
+        n_samples=200,
+        optimise=False
+    )
+    assert len(dates) == len(proba) == len(schedule) == 10
+    assert ((proba >= 0) & (proba <= 1)).all()
+    assert schedule == [int(p >= 0.5) for p in proba]
+
+
+@pytest.mark.parametrize('n_samples', [0, -1])
+def test_bernoulli_plan_ensemble_no_samples(plant, run_date, n_samples):
+    with pytest.raises(ValueError):
+        planners.get_planner('bayes').plan_ensemble(
+            plant, 'water', start_date=run_date, n_samples=n_samples, optimise=False
+        )
+
+
+def test_plan_all_matches_plan(plant, run_date):
+    plant.needs = {
+        'water': {'freq': 0.2},
+        'mist': {'freq': 0.1},
+        'light': {'score': 0.7}
+    }
+    planner = planners.get_planner('dynamic')
+    res = planner.plan_all(plant, start_date=run_date, n_days=20, optimise=False)
+    assert list(res) == ['water', 'mist']
+    for care_type, (dates, results) in res.items():
+        assert (dates, results) == planner.plan(
+            plant, care_type, start_date=run_date, n_days=20, optimise=False
+        )
+
+
+def test_plan_parallel(plant, run_date, needs):
+    rows = [
+        ('0', 'guacamole', '{}', 'guacamole'),
+        ('1', 'avocado', '{}', 'guacamole'),
+        ('2', 'pepper', '{}', 'guacamole'),
+    ]
+    with mock.patch.object(CareHistory, 'query', return_value=[]), \
+            mock.patch('app.db.CareNeeds.get', return_value=needs), \
+            mock.patch.object(planners, 'ProcessPoolExecutor', ThreadPoolExecutor):
+        dates, results = planners.plan_parallel(
+            'naive',
+            rows,
+            'water',
+            start_date=run_date,
+            n_days=5,
+            optimise=False,
+            workers=2
+        )
+    assert len(dates) == 5
+    assert results.shape == (3, 5)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='requires fork')
+def test_plan_parallel_processes(plant, run_date, hist, needs):
+    rows = [
+        ('0', 'guacamole', '{}', 'guacamole'),
+        ('1', 'avocado', '{}', 'guacamole'),
+        ('2', 'pepper', '{}', 'guacamole'),
+    ]
+    fork_pool = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('fork'))
+    with mock.patch.object(CareHistory, 'query', return_value=hist), \
+            mock.patch('app.db.CareNeeds.get', return_value=needs['guacamole']), \
+            mock.patch.object(PlantTaxonomy, 'query', return_value=None), \
+            mock.patch.object(planners, 'ProcessPoolExecutor', fork_pool):
+        dates, results = planners.plan_parallel(
+            'naive', rows, 'water', start_date=run_date, n_days=5, optimise=False, workers=2
+        )
+        plants = [PlantUnit(row[0], row[1], {}, row[3]) for row in rows]
+        expected = planners.get_planner('naive').plan_batch(
+            plants, 'water', start_date=run_date, n_days=5, optimise=False
+        )
+    assert dates == expected[0]
+    assert results.tolist() == np.asarray(expected[1]).tolist()
+
+
+@pytest.mark.parametrize('planner_name', ['naive', 'dynamic'])
+def test_plan_horizon_matches_plan(plants, run_date, planner_name):
+    planner = planners.get_planner(planner_name)
+    for plant in plants:
+        assert planner.plan_horizon(
+            plant, 'water', start_date=run_date, n_days=365, optimise=False
+        ) == planner.plan(
+            plant, 'water', start_date=run_date, n_days=365, optimise=False
+        )
+
+
+def test_plan_batch_matches_plan_lookback_80(plant, run_date):
+    plant.needs = {'water': {'freq': 0.0125}}
+    plant.hist.hist = [('guacamole', 'water', str(run_date - dt.timedelta(59)))]
+    plant.hist._index = dict()
+    planner = planners.get_planner('dynamic')
+    expected = planner.plan(plant, 'water', start_date=run_date, n_days=5, optimise=False)
+    assert planner.plan_horizon(plant, 'water', start_date=run_date, n_days=5, optimise=False) == expected
+    _, results = planner.plan_batch([plant], 'water', start_date=run_date, n_days=5, optimise=False)
+    assert results[0].tolist() == expected[1]
+
+
+def test_plan_with_climate_series(plant, run_date):
+    plant.needs = {
+        'water': {'freq': 0.2},
+        'air': {'temperature': {'min': 15, 'max': 26}}
+    }
+    frame = pd.DataFrame(
+        {'tavg': [12.0] * 16 + [32.0] * 10, 'tmin': np.nan, 'tmax': np.nan, 'tsun': np.nan},
+        index=pd.date_range(run_date - dt.timedelta(15), periods=26, freq='D')
+    )
+    planner = planners.get_planner('naive')
+    with mock.patch.object(ClimateConditions, 'snapshots', OrderedDict()):
+        ClimateConditions.put({}, None, ClimateSeries.from_frame(frame))
+        dates, results = planner.plan_batch([plant], 'water', start_date=run_date, n_days=20)
+        needs = planner.needs([plant], 'water', dates=dates)
+        assert needs[0, 0] != needs[0, -1]
+        assert (dates, results[0].tolist()) == planner.plan(plant, 'water', start_date=run_date, n_days=20)
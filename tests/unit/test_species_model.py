@@ -1,7 +1,16 @@
+import io
+import os
+import time
+import threading
 import pytest
+from PIL import Image
 from mock import patch
 
 from plenty.models.species import predict
+from plenty.models.species import PredictionFailureException
+from plenty.models.species import fuse_results
+from app.db.species import PredictionCache
+from plenty.models.utils import downscale_image
 
 
 class MockResponse:
@@ -35,6 +44,22 @@ def success_response_dict():
         }
 
 
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'store').mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def images_path(store):
+    path = store / 'images'
+    path.mkdir()
+    (path / 'a.jpg').write_bytes(b'leaf-a')
+    (path / 'b.jpg').write_bytes(b'leaf-b')
+    return str(path)
+
+
 @pytest.fixture
 def apikey():
     return '00apikey'
@@ -57,23 +82,175 @@ def success_response(success_response_dict):
 
 
 @patch('plenty.api.util.get_api_key')
-@patch('requests.post')
-@patch('plenty.models.species.load_images')
-def test_get_prediction_best_response(mock_image_loader, mock_request, mock_utils_get_api_key, success_response):
-    mock_image_loader.return_value = [None], ['']
+@patch('requests.Session.request')
+def test_get_prediction_best_response(mock_request, mock_utils_get_api_key, success_response, images_path):
     mock_utils_get_api_key.return_value = apikey
     mock_request.return_value = success_response
-    prediction = predict('best')
+    prediction = predict('best', path=images_path)
     assert prediction[0]['proba'] == 1.0
     assert len(prediction) == 1
 
 
 @patch('plenty.api.util.get_api_key')
-@patch('requests.post')
-@patch('plenty.models.species.load_images')
-def test_get_prediction_topn_response(mock_image_loader, mock_request, mock_utils_get_api_key, success_response):
-    mock_image_loader.return_value = [None], ['']
+@patch('requests.Session.request')
+def test_get_prediction_topn_response(mock_request, mock_utils_get_api_key, success_response, images_path):
     mock_utils_get_api_key.return_value = apikey
     mock_request.return_value = success_response
-    prediction = predict('topn', n=3)
+    prediction = predict('topn', n=3, path=images_path)
     assert len(prediction) == 2
+
+
+@patch('plenty.api.util.get_api_key', return_value='00apikey')
+@patch('requests.Session.request')
+def test_get_prediction_cached(mock_request, mock_utils_get_api_key, success_response, failed_response, images_path):
+    mock_request.return_value = success_response
+    prediction = predict('best', path=images_path)
+    mock_request.return_value = failed_response
+    assert predict('topn', topn=2, path=images_path) == prediction + [
+        {'proba': 0.4, 'scientificName': 'Mr. Meekseeks Plant', 'commonNames': ['Mr. Meekseeks']}
+    ]
+    assert mock_request.call_count == 1
+    with pytest.raises(PredictionFailureException):
+        predict('best', refresh=True, path=images_path)
+    assert mock_request.call_count == 2
+
+
+def test_prediction_cache_key(images_path):
+    a, b = images_path + '/a.jpg', images_path + '/b.jpg'
+    assert PredictionCache.key([a, b], ['leaf', 'leaf']) == PredictionCache.key([b'leaf-b', b'leaf-a'], ['leaf', 'leaf'])
+    assert PredictionCache.key([a], ['leaf']) != PredictionCache.key([a], ['flower'])
+
+
+def test_prediction_cache_eviction(store):
+    with patch.object(PredictionCache, 'max_entries', 2):
+        for i in range(3):
+            PredictionCache.add(PredictionCache.key([bytes([i])], ['leaf']), [{'proba': i}])
+            time.sleep(0.01)
+        assert PredictionCache.get(PredictionCache.key([b'\x00'], ['leaf'])) is None
+        assert PredictionCache.get(PredictionCache.key([b'\x02'], ['leaf'])) == [{'proba': 2}]
+
+
+def _encode(size, orientation=None, fmt='JPEG'):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new('RGB', size, (0, 128, 0)).save(buffer, format=fmt, exif=exif)
+    return buffer.getvalue()
+
+
+def test_downscale_image():
+    image = _encode((4000, 3000), orientation=6)
+    with Image.open(io.BytesIO(downscale_image(image, long_edge=400, quality=80))) as img:
+        assert img.format == 'JPEG'
+        assert img.size == (300, 400)
+        assert img.getexif().get(0x0112, 1) == 1
+    small = _encode((200, 100))
+    assert downscale_image(small, long_edge=400) is small
+    assert downscale_image(b'not an image') == b'not an image'
+
+
+@patch('plenty.models.species.get_prediction')
+def test_predict_uploads_downscaled(mock_get_prediction, success_response_dict, store):
+    image = _encode((3000, 2000), fmt='PNG')
+    (store / 'images').mkdir()
+    (store / 'images' / 'a.png').write_bytes(image)
+    (store / 'images' / 'b.png').write_bytes(_encode((200, 100), fmt='PNG'))
+    mock_get_prediction.return_value = success_response_dict, True
+    with patch('plenty.models.species.UPLOAD_LONG_EDGE', 300):
+        predict('best', path=str(store / 'images'), downscale=True)
+    images, _, names = mock_get_prediction.call_args.args
+    assert sorted(os.path.basename(name) for name in names) == ['a.jpg', 'b.png']
+    uploaded = images[[os.path.basename(name) for name in names].index('a.jpg')]()
+    assert images[[os.path.basename(name) for name in names].index('b.png')].endswith('b.png')
+    assert len(uploaded) < len(image)
+    with Image.open(io.BytesIO(uploaded)) as img:
+        assert img.format == 'JPEG'
+        assert img.size == (300, 200)
+
+
+@patch('plenty.models.species.get_prediction')
+def test_predict_resizes_in_parallel(mock_get_prediction, success_response_dict, store):
+    (store / 'images').mkdir()
+    for i in range(12):
+        (store / 'images' / F'{i}.jpg').write_bytes(bytes([i]))
+    lock, active, peak = threading.Lock(), [0], [0]
+
+    def downscale(image, long_edge, quality):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return b'resized'
+
+    mock_get_prediction.return_value = success_response_dict, True
+    with patch('plenty.models.species.needs_downscale', return_value=True), \
+            patch('plenty.models.species.downscale_image', side_effect=downscale), \
+            patch('plenty.models.species.UPLOAD_WORKERS', 2):
+        predict('best', path=str(store / 'images'), downscale=True)
+    assert peak[0] == 2
+    images = mock_get_prediction.call_args.args[0]
+    assert [image() for image in images] == [b'resized'] * len(images)
+
+
+def _result(name, proba):
+    return {'proba': proba, 'scientificName': name, 'commonNames': []}
+
+
+def test_fuse_results():
+    groups = [
+        [_result('Monstera', 0.8), _result('Ficus', 0.1)],
+        [_result('Ficus', 0.9)],
+    ]
+    assert fuse_results(groups, 'max') == [_result('Ficus', 0.9), _result('Monstera', 0.8)]
+    assert fuse_results(groups, 'mean') == [_result('Ficus', 0.5), _result('Monstera', 0.4)]
+    with pytest.raises(ValueError):
+        fuse_results(groups, 'median')
+
+
+@patch('plenty.models.species.get_prediction')
+def test_predict_in_groups(mock_get_prediction, success_response_dict, store):
+    (store / 'images').mkdir()
+    for i in range(12):
+        (store / 'images' / F'{i}.jpg').write_bytes(bytes([i]))
+    lock, active, peak = threading.Lock(), [0], [0]
+
+    def get_prediction(*args):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return success_response_dict, True
+
+    mock_get_prediction.side_effect = get_prediction
+    with patch('plenty.models.species.REQUEST_WORKERS', 2):
+        prediction = predict('topn', topn=5, path=str(store / 'images'), downscale=False)
+    sizes = sorted(len(c.args[0]) for c in mock_get_prediction.call_args_list)
+    assert sizes == [2, 5, 5]
+    assert peak[0] == 2
+    assert [r['proba'] for r in prediction] == [1.0, 0.4]
+    mock_get_prediction.side_effect = None
+    mock_get_prediction.return_value = {}, False
+    with pytest.raises(PredictionFailureException):
+        predict('best', path=str(store / 'images'), fusion='mean')
+
+
+@patch('plenty.models.species.get_prediction')
+def test_predict_no_images(mock_get_prediction, store):
+    (store / 'images').mkdir()
+    with pytest.raises(PredictionFailureException):
+        predict('best', path=str(store / 'images'))
+    mock_get_prediction.assert_not_called()
+    assert PredictionCache.get(PredictionCache.key([], [])) is None
+
+
+@patch('plenty.models.species.get_prediction')
+def test_predict_uploads_originals_by_default(mock_get_prediction, success_response_dict, images_path):
+    mock_get_prediction.return_value = success_response_dict, True
+    predict('best', path=images_path)
+    images, _, names = mock_get_prediction.call_args.args
+    assert images == names and sorted(os.path.basename(name) for name in names) == ['a.jpg', 'b.jpg']